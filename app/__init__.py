@@ -12,7 +12,15 @@ def create_app(config_class=None):
     app.config.from_object(config_class)
     
     # Initialize extensions
+    from app.database import configure_engines, register_pragmas
+    configure_engines(app)
     db.init_app(app)
+    with app.app_context():
+        register_pragmas(app, db.engines)
+    
+    # Bộ đếm thay đổi theo bảng cho ETag/cache của các API đọc
+    from app.cache import register_version_listeners
+    register_version_listeners()
     
     # Initialize Flask-Login
     login_manager = LoginManager()
@@ -41,9 +49,16 @@ def create_app(config_class=None):
     from app.routes.agent_api import bp as agent_bp
     app.register_blueprint(agent_bp, url_prefix='/api/agent')
     
+    # CLI commands (flask rebuild-profiles, ...)
+    from app.commands import register_commands
+    register_commands(app)
+    
     # Create database tables
     with app.app_context():
-        db.create_all()
+        # create_all + migrations dưới cùng 1 lock giữa các workers; các backfill
+        # (TableVersion, UserProfileStats, BookingCounter) là migrations, mỗi version chạy đúng 1 lần
+        from app.migrations import run_migrations
+        run_migrations(db.engine, db.metadata)
         # Initialize default rooms if they don't exist
         from app.models import Room
         if Room.query.count() == 0:
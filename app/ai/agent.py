@@ -1,13 +1,31 @@
 from datetime import datetime, timedelta
-from collections import defaultdict, Counter
-from typing import List, Dict, Set, Tuple, Optional
+from collections import Counter
+from typing import Callable, Iterable, List, Dict, Set, Tuple, Optional
+import heapq
 import json
 import re
 import os
-from openai import OpenAI
+import threading
+from flask import g, has_app_context
+from openai import OpenAI, DefaultHttpxClient
+
+from app.ai.batch import BatchMeeting, BatchPlanner
+from app.ai.directory import SQL_IN_CHUNK, Membership, user_directory
+from app.ai.llm_cache import LLMResponseCache
+from app.ai.rooms import RoomInfo, RoomIntervalIndex
+from app.ai.scoring import LocalScorer
+from app.ai.stream_json import SlotStreamParser
+from app.ai.availability import (
+    AvailabilityGrid, WeeklyTemplate, weekly_templates, mask_of, ids_of, iter_ids, popcount
+)
 
 WORKING_HOURS = {'start': 7, 'end': 22}  # 7h sáng - 10h tối
 DAYS_OF_WEEK = 7
+VALID_SLOT_MINUTES = (5, 10, 15, 20, 30, 60)  # Độ phân giải giờ bắt đầu slot (ước của 60)
+AI_CANDIDATE_SLOTS = 10  # Số slots tốt nhất gửi cho AI phân tích
+SCORING_MODES = ('llm', 'local', 'hybrid')
+BATCH_CANDIDATES = 40  # Số candidates tốt nhất giữ lại cho mỗi meeting khi xếp lịch theo lô
+HISTORY_DAYS = 90  # Cửa sổ lịch sử booking để học pattern (giờ/ngày ưa thích)
 
 WEIGHTS = {
     'attendance_count': 3.0,      # Số người tham dự
@@ -17,14 +35,21 @@ WEIGHTS = {
     'required_members': 5.0,      # Thành viên bắt buộc
     'time_preference': 1.5,       # Khung giờ ưa thích
     'recency': 1.0,               # Gần với hiện tại
-    'day_preference': 1.2         # Ngày trong tuần phù hợp
+    'day_preference': 1.2,        # Ngày trong tuần phù hợp
+    'preferred_members': 2.0      # Thành viên ưu tiên
 }
 
 
 class MeetingSchedulerAgent:
+    """
+    Agent dùng chung cho cả process (xem `get_agent`).
+    State theo từng request (profiles, scorers...) nằm trong thread-local
+    để các thread gunicorn chạy song song không ghi đè lên nhau.
+    """
+    
     def __init__(self, db_session, api_key: Optional[str] = None, model: Optional[str] = None):
         self.db = db_session
-        self.booking_history = []
+        self._local = threading.local()
         
         from config import Config
 
@@ -34,11 +59,33 @@ class MeetingSchedulerAgent:
         if not self.api_key:
             raise ValueError("NVIDIA API key is required. Set NVIDIA_API_KEY in .env file")
  
-        self.client = OpenAI(
-            base_url="https://integrate.api.nvidia.com/v1",
-            api_key=self.api_key
+        self._client = None
+        self._client_lock = threading.Lock()
+        self.stream = Config.AI_STREAM
+        self.scoring_mode = Config.AI_SCORING_MODE if Config.AI_SCORING_MODE in SCORING_MODES else 'llm'
+        self.ambiguity_margin = Config.AI_AMBIGUITY_MARGIN
+        self.response_cache = LLMResponseCache(
+            max_entries=Config.AI_CACHE_MAX_ENTRIES,
+            ttl_seconds=Config.AI_CACHE_TTL,
+            db_path=Config.AI_CACHE_PATH
         )
         print(f"NVIDIA Agent initialized with model: {self.model}")
+    
+    @property
+    def client(self) -> OpenAI:
+        """
+        OpenAI client dùng chung, tạo lần đầu khi cần gọi LLM.
+        HTTP connection pool giữ kết nối keep-alive tới inference endpoint.
+        """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = OpenAI(
+                        base_url="https://integrate.api.nvidia.com/v1",
+                        api_key=self.api_key,
+                        http_client=_build_http_client()
+                    )
+        return self._client
         
     # 1. Lấy dữ liệu từ Database
     
@@ -49,7 +96,7 @@ class MeetingSchedulerAgent:
         from app.models import UserAvailability
         return UserAvailability.query.all()
     
-    def get_all_users(self, club_filter: Optional[str]) -> List:
+    def get_all_users(self, club_filter: Optional[str] = None) -> List:
         """
         Lấy danh sách users, có thể filter theo club
         """
@@ -59,18 +106,18 @@ class MeetingSchedulerAgent:
             query = query.filter_by(club=club_filter)
         return query.all()
     
-    def get_booking_history(self, days_back: int = 90) -> List:
+    def load_room_index(self, window_start: datetime, window_end: datetime) -> RoomIntervalIndex:
         """
-        Lấy lịch sử booking để học pattern
+        Load phòng + các booking confirmed giao với [window_start, window_end)
+        thành index khoảng đã đặt theo phòng (2 query, chỉ lấy cột cần dùng)
         """
-        from app.models import Booking
-        cutoff_date = datetime.utcnow() - timedelta(days=days_back)
-        bookings = Booking.query.filter(
-            Booking.start_time >= cutoff_date,
+        from app.models import Booking, Room
+        rooms = self.db.query(Room.id, Room.name, Room.capacity).all()
+        bookings = self.db.query(Booking.room_id, Booking.start_time, Booking.end_time).filter(
+            *Booking.overlaps(window_start, window_end),
             Booking.status == 'confirmed'
         ).all()
-        self.booking_history = bookings
-        return bookings
+        return RoomIntervalIndex.from_bookings(rooms, bookings)
     
     # 2. Phân tích dữ liệu user và lịch sử
 
@@ -78,123 +125,184 @@ class MeetingSchedulerAgent:
         """
         Phân tích lịch sử booking của user để tạo summary
         """
-        from app.models import Booking, User
+        return self.load_user_profiles([user_id]).get(user_id, {})
+    
+    def load_user_profiles(self, user_ids: Optional[Iterable[int]] = None) -> Dict[int, Dict]:
+        """
+        Tạo summary cho nhiều users cùng lúc (cùng format với analyze_user_history):
+        thông tin user từ user_directory, bookings confirmed trong HISTORY_DAYS ngày
+        gần đây từ UserProfileSlot, tỉ lệ tham dự từ UserProfileStats (không tổng
+        hợp lại bảng Booking). user_ids=None để lấy mọi users có booking trong cửa sổ.
+        Kết quả được memoize trong request hiện tại (xem _reset_profiles).
+        """
+        from app.models import UserProfileStats
         
-        user = User.query.get(user_id)
-        if not user:
-            return {}
+        self._sync_request()
+        profiles = getattr(self._local, 'profiles', None)
+        if profiles is None:
+            profiles = self._local.profiles = {}
         
-        user_bookings = [b for b in self.booking_history if b.user_id == user_id]
+        since = datetime.utcnow() - timedelta(days=HISTORY_DAYS)
+        if user_ids is None:
+            if getattr(self._local, 'all_profiles_loaded', False):
+                return profiles
+            histograms = self._load_profile_histograms(None, since)
+            missing = [uid for uid in histograms if uid not in profiles]
+            self._local.all_profiles_loaded = True
+        else:
+            missing = [uid for uid in dict.fromkeys(user_ids) if uid not in profiles]
+            if not missing:
+                return profiles
+            # Đã load cả cửa sổ thì các IDs còn thiếu là users không có booking trong đó
+            if getattr(self._local, 'all_profiles_loaded', False):
+                histograms = {}
+            else:
+                histograms = self._load_profile_histograms(missing, since)
         
-        if not user_bookings:
-            return {
-                'user_id': user_id,
+        stats_rows = {}
+        for chunk in _chunks([uid for uid in missing if uid in histograms], SQL_IN_CHUNK):
+            stats_rows.update((row.user_id, row) for row in self.db.query(UserProfileStats).filter(
+                UserProfileStats.user_id.in_(chunk)))
+        
+        users = user_directory.get_many(missing)
+        for uid in missing:
+            user = users.get(uid)
+            if not user:
+                profiles[uid] = {}
+                continue
+            
+            if uid not in histograms:
+                profiles[uid] = {
+                    'user_id': uid,
+                    'username': user.username,
+                    'club': user.club,
+                    'is_mentor': user.is_admin,
+                    'total_bookings': 0,
+                    'attendance_rate': 0.7 
+                }
+                continue
+            
+            hour_counts, day_counts = histograms[uid]
+            stats = stats_rows.get(uid)
+            total = stats.total_bookings if stats else 0
+            attendance_rate = stats.confirmed_bookings / total if total > 0 else 0.7
+            
+            profiles[uid] = {
+                'user_id': uid,
                 'username': user.username,
                 'club': user.club,
                 'is_mentor': user.is_admin,
-                'total_bookings': 0,
-                'attendance_rate': 0.7 
+                'total_bookings': sum(hour_counts.values()),
+                'preferred_hours': dict(hour_counts.most_common(3)),
+                'preferred_days': dict(day_counts.most_common(3)),
+                'attendance_rate': attendance_rate
             }
         
-        hour_counts = Counter()
-        day_counts = Counter()
-        
-        for booking in user_bookings:
-            hour_counts[booking.start_time.hour] += 1
-            day_counts[booking.start_time.weekday()] += 1
-
-        total = Booking.query.filter_by(user_id=user_id).count()
-        confirmed = Booking.query.filter_by(user_id=user_id, status='confirmed').count()
-        attendance_rate = confirmed / total if total > 0 else 0.7
+        return profiles
+    
+    def _load_profile_histograms(self, user_ids: Optional[List[int]],
+                                 since: datetime) -> Dict[int, Tuple[Counter, Counter]]:
+        """
+        {user_id: (Counter giờ, Counter ngày)} của bookings confirmed bắt đầu từ `since`
+        (chỉ users có ít nhất 1 booking), user_ids=None để lấy tất cả.
+        Các ngày sau ngày của `since` cộng từ UserProfileSlot; riêng ngày của `since`
+        đếm thẳng từ Booking (1 ngày, theo index) để cận dưới chính xác tới giây.
+        """
+        from app.models import Booking, UserProfileSlot
+        next_day = datetime.combine(since.date() + timedelta(days=1), datetime.min.time())
+        slot_query = self.db.query(
+            UserProfileSlot.user_id, UserProfileSlot.day, UserProfileSlot.hour, UserProfileSlot.count
+        ).filter(UserProfileSlot.day >= next_day.strftime('%Y-%m-%d'), UserProfileSlot.count > 0)
+        first_day_query = self.db.query(Booking.user_id, Booking.start_time).filter(
+            Booking.status == 'confirmed', Booking.start_time >= since, Booking.start_time < next_day
+        )
+        if user_ids is None:
+            slot_rows = slot_query.all()
+            first_day_rows = first_day_query.all()
+        else:
+            slot_rows, first_day_rows = [], []
+            for chunk in _chunks(user_ids, SQL_IN_CHUNK):
+                slot_rows += slot_query.filter(UserProfileSlot.user_id.in_(chunk)).all()
+                first_day_rows += first_day_query.filter(Booking.user_id.in_(chunk)).all()
         
-        return {
-            'user_id': user_id,
-            'username': user.username,
-            'club': user.club,
-            'is_mentor': user.is_admin,
-            'total_bookings': len(user_bookings),
-            'preferred_hours': dict(hour_counts.most_common(3)),
-            'preferred_days': dict(day_counts.most_common(3)),
-            'attendance_rate': attendance_rate
-        }
+        histograms = {}
+        for user_id, start_time in first_day_rows:
+            hours, days = histograms.setdefault(user_id, (Counter(), Counter()))
+            hours[start_time.hour] += 1
+            days[start_time.weekday()] += 1
+        weekdays = {}
+        for user_id, day, hour, count in slot_rows:
+            weekday = weekdays.get(day)
+            if weekday is None:
+                weekday = weekdays[day] = datetime.strptime(day, '%Y-%m-%d').weekday()
+            hours, days = histograms.setdefault(user_id, (Counter(), Counter()))
+            hours[hour] += count
+            days[weekday] += count
+        return histograms
+    
+    def _reset_profiles(self):
+        """Bỏ profiles/scorers đã memoize (đầu mỗi request tìm slots)"""
+        self._local.profiles = None
+        self._local.all_profiles_loaded = False
+        self._local.scorers = None
+        self._local.request = _request_token()
+    
+    def _sync_request(self):
+        """State memoize trong thread-local chỉ dùng trong 1 request: sang request khác thì bỏ"""
+        token = _request_token()
+        if token is not None and getattr(self._local, 'request', None) is not token:
+            self._reset_profiles()
         
     # 3. Phân tích lịch rảnh/bận
     
-    def build_availability_grid(self, availabilities: List, days_ahead: int) -> Dict:
+    def _all_user_mask(self) -> int:
+        from app.models import User
+        return mask_of(uid for (uid,) in self.db.query(User.id))
+    
+    def get_weekly_template(self) -> WeeklyTemplate:
         """
-        Xây dựng lưới thời gian biểu
+        Lấy template lịch bận theo tuần (compile 1 lần, cache trong process,
+        compile lại khi bộ đếm thay đổi của bảng user_availability tăng)
         """
-        from app.models import User
-        all_users = User.query.all()
-        all_user_ids = {u.id for u in all_users}
+        from app.cache import table_versions
+        return weekly_templates.get(self.get_all_user_availability,
+                                    version=table_versions.get('user_availability'))
+    
+    def build_availability_grid(self, availabilities: Optional[List], days_ahead: int) -> AvailabilityGrid:
+        """
+        Xây dựng lưới thời gian biểu (bitmask users rảnh theo ngày và giờ)
         
-        # Tạo grid theo ngày và giờ
-        grid = defaultdict(lambda: defaultdict(lambda: {
-            'busy_users': set(),
-            'available_users': set(),
-            'total_users': len(all_user_ids)
-        }))
+        Args:
+            availabilities: Rows UserAvailability, None để dùng template đã cache
+            days_ahead: Số ngày tính từ hôm nay
+        """
+        all_mask = self._all_user_mask()
         
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        if availabilities is None:
+            template = self.get_weekly_template()
+        else:
+            template = WeeklyTemplate.from_rows(availabilities)
         
-        # Map availability vào grid
-        for i in range(days_ahead):
-            current_date = today + timedelta(days=i)
-            date_str = current_date.strftime('%Y-%m-%d')
-            day_of_week = current_date.weekday()
-            
-            for hour in range(WORKING_HOURS['start'], WORKING_HOURS['end']):
-                # Tìm users bận vào giờ này
-                busy_users = set()
-                for av in availabilities:
-                    if av.day_of_week == day_of_week and av.is_busy:
-                        if av.start_hour <= hour < av.end_hour:
-                            busy_users.add(av.user_id)
-                
-                available_users = all_user_ids - busy_users
-                
-                grid[date_str][hour] = {
-                    'busy_users': busy_users,
-                    'available_users': available_users,
-                    'total_users': len(all_user_ids)
-                }
-        
-        return grid
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        return template.project(all_mask, today, days_ahead,
+                                WORKING_HOURS['start'], WORKING_HOURS['end'])
     
     # 4. Sử dụng AI để phân tích và đưa ra quyết định
     
     def ask_gpt_to_analyze_slots(self, candidate_slots: List[Dict], 
-                                  constraints: Dict, objective: str) -> List[Dict]:
+                                  constraints: Dict, objective: str,
+                                  on_slot_score: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
         """
         Sử dụng AI để phân tích và chấm điểm các slots
+        
+        Args:
+            on_slot_score: Callback nhận từng {"index", "score", "reasoning"}
+                ngay khi parse xong (chỉ ở chế độ stream)
         """
         print(f"Đang sử dụng ({self.model}) để phân tích {len(candidate_slots)} slots...")
         
         max_slots_to_analyze = min(20, len(candidate_slots))
-        slots_summary = []
-        for idx, slot in enumerate(candidate_slots[:max_slots_to_analyze]):
-            user_summaries = []
-            for uid in list(slot['available_users'])[:10]:
-                history = self.analyze_user_history(uid)
-                if history:
-                    user_summaries.append({
-                        'id': uid,
-                        'username': history.get('username', 'Unknown'),
-                        'club': history.get('club', 'Unknown'),
-                        'is_mentor': history.get('is_mentor', False),
-                        'total_bookings': history.get('total_bookings', 0),
-                        'attendance_rate': history.get('attendance_rate', 0.7)
-                    })
-            
-            slots_summary.append({
-                'index': idx,
-                'start_time': slot['start_time'].strftime('%Y-%m-%d %H:%M'),
-                'end_time': slot['end_time'].strftime('%H:%M'),
-                'day_of_week': slot['day_of_week'],
-                'hour': slot['hour'],
-                'available_count': slot['available_count'],
-                'users': user_summaries
-            })
+        slots_summary = self._slot_summaries(candidate_slots[:max_slots_to_analyze])
         
         system_prompt = """Bạn là AI lập lịch họp. Phân tích và chấm điểm slots. Hãy nhớ lịch đó phải có thời gian bắt đầu(start_time) phải muộn hơn thời gian thực tế hiện tại ít nhất 2 tiếng.
         Chỉ trả về duy nhất 1 đối tượng JSON hợp lệ. Không được thêm bất kỳ JSON giải thích, văn bản hay markdown nào khác.
@@ -222,59 +330,300 @@ SLOTS (mỗi slot có: thời gian, số người rảnh, có mentor không):
 
 Chỉ trả về JSON. Lý do phải ngắn (max 15 từ)."""
         
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.2,
-                stream=False
-            )
-            
-            response_text = response.choices[0].message.content
-            finish_reason = response.choices[0].finish_reason
-            
-            print(f"Llama Response length: {len(response_text)} chars")
+        cache_key = self.response_cache.make_key(
+            self.model, system_prompt, slots_summary, constraints, objective, WEIGHTS
+        )
+        slots, _ = self._score_with_llm(candidate_slots, system_prompt, user_prompt, cache_key,
+                                        max_slots_to_analyze, on_slot_score)
+        return slots
+    
+    def ask_gpt_to_analyze_objectives(self, candidates: Dict[str, List[Dict]], constraints: Dict,
+                                      on_slot_score: Optional[Callable[[str, int, Dict], None]] = None):
+        """
+        1 lần gọi AI chấm điểm candidates của nhiều objectives cùng lúc (thay vì
+        mỗi objective 1 lần gọi). Slot xuất hiện ở nhiều objectives chỉ gửi 1 lần,
+        AI trả về điểm riêng cho từng objective của slot đó.
+        
+        Args:
+            candidates: {objective: candidate slots} - điểm được gắn trực tiếp vào các slots
+            on_slot_score: Callback(objective, index trong candidates[objective], item)
+                ngay khi parse xong từng slot (chỉ ở chế độ stream)
+        """
+        # Gộp các slot trùng nhau giữa các objectives
+        union = []
+        positions = {}  # key slot -> index trong union
+        members = []    # index trong union -> [(objective, index trong candidates[objective])]
+        for objective, slots in candidates.items():
+            for idx, slot in enumerate(slots[:20]):
+                key = (slot['start_time'], slot['end_time'], slot['room_id'])
+                if key not in positions:
+                    positions[key] = len(union)
+                    union.append(slot)
+                    members.append([])
+                members[positions[key]].append((objective, idx))
+        print(f"Đang sử dụng ({self.model}) để phân tích {len(union)} slots cho {len(candidates)} objectives...")
+        
+        slots_summary = self._slot_summaries(union)
+        for summary, slot_members in zip(slots_summary, members):
+            summary['objectives'] = [objective for objective, _ in slot_members]
+        
+        system_prompt = """Bạn là AI lập lịch họp. Phân tích và chấm điểm slots theo từng mục tiêu. Hãy nhớ lịch đó phải có thời gian bắt đầu(start_time) phải muộn hơn thời gian thực tế hiện tại ít nhất 2 tiếng.
+        Chỉ trả về duy nhất 1 đối tượng JSON hợp lệ. Không được thêm bất kỳ JSON giải thích, văn bản hay markdown nào khác.
 
-            if finish_reason == "length":
-                print(f"WARNING: Response bị truncate! Chuyển sang fallback.")
-                raise ValueError("Response truncated")
-            
-            json_match = re.search(r'\{[\s\S]*\}', response_text)
-            
-            if json_match:
-                clean_json_str = json_match.group(0)
-            else:
-                print(f"Raw response không chứa JSON hợp lệ: {response_text[:100]}...")
-                raise ValueError("No JSON found in response")
+Trả về JSON format BẮT BUỘC:
+{
+  "analysis": "1-2 câu tổng quan",
+  "slots": [
+    {"index": 0, "scores": {"<mục tiêu>": số nguyên từ 0-100(phải chấm điểm)}, "reasoning": "Lý do ngắn (max 20 từ)"}
+  ]
+}
+"""
+        
+        user_prompt = f"""Chấm điểm {len(slots_summary)} slots sau (0-100 điểm) cho từng mục tiêu trong "objectives" của slot:
 
-            result = json.loads(clean_json_str)
-            print(f"Analysis: {result.get('analysis', 'Done')}")
-            
-            slot_scores_map = {item.get('index'): item for item in result.get('slots', [])}
-            for idx, slot in enumerate(candidate_slots[:max_slots_to_analyze]):
-                gpt_data = slot_scores_map.get(idx) 
-                
-                if gpt_data:
-                    slot['gpt_score'] = gpt_data.get('score', 50)
-                    slot['gpt_reasoning'] = gpt_data.get('reasoning', 'No reasoning')
-                else:
-                    slot['gpt_score'] = 50
-                    slot['gpt_reasoning'] = 'Not analyzed (Index missing)'
+MỤC TIÊU: {json.dumps(list(candidates), ensure_ascii=False)}
+
+RÀNG BUỘC: {json.dumps(constraints, ensure_ascii=False) if constraints else "Không có"}
+
+TRỌNG SỐ CHẤM ĐIỂM: {json.dumps(WEIGHTS, ensure_ascii=False)}
 
-            return candidate_slots
+
+SLOTS (mỗi slot có: thời gian, số người rảnh, có mentor không, các mục tiêu cần chấm):
+{json.dumps(slots_summary, ensure_ascii=False)}
+
+Chỉ trả về JSON. Lý do phải ngắn (max 15 từ)."""
+        
+        def on_item(item):
+            idx = item.get('index')
+            scores = item.get('scores')
+            if not on_slot_score or not isinstance(idx, int) or not 0 <= idx < len(union) \
+                    or not isinstance(scores, dict):
+                return
+            for objective, local_idx in members[idx]:
+                if objective in scores:
+                    on_slot_score(objective, local_idx, {'index': local_idx, 'score': scores[objective],
+                                                         'reasoning': item.get('reasoning')})
+        
+        cache_key = self.response_cache.make_key(
+            self.model, system_prompt, slots_summary, constraints, list(candidates), WEIGHTS
+        )
+        try:
+            result, complete = self._llm_result(system_prompt, user_prompt, cache_key, on_item)
+        except (json.JSONDecodeError, ValueError, Exception) as e:
+            print(f"Lỗi xử lý Llama ({type(e).__name__}): {e}")
+            
+            print("Sử dụng fallback scoring...")
+            for slots in candidates.values():
+                for slot in slots:
+                    self._apply_fallback_score(slot)
+            return
+        
+        # Tách kết quả chung thành kết quả riêng cho từng objective
+        per_objective = {objective: [] for objective in candidates}
+        for item in result.get('slots', []):
+            idx = item.get('index')
+            scores = item.get('scores')
+            if not isinstance(idx, int) or not 0 <= idx < len(union) or not isinstance(scores, dict):
+                continue
+            for objective, local_idx in members[idx]:
+                if objective in scores:
+                    per_objective[objective].append({'index': local_idx, 'score': scores[objective],
+                                                     'reasoning': item.get('reasoning', 'No reasoning')})
+        for objective, slots in candidates.items():
+            self._apply_gpt_scores(slots, {'slots': per_objective[objective]}, min(20, len(slots)),
+                                   partial=not complete)
+    
+    def _slot_summaries(self, slots: List[Dict]) -> List[Dict]:
+        """Tóm tắt slots (kèm tối đa 10 users rảnh đầu tiên) để gửi cho AI"""
+        profiles = self.load_user_profiles(
+            uid for slot in slots for uid in list(slot['available_users'])[:10]
+        )
+        slots_summary = []
+        for idx, slot in enumerate(slots):
+            user_summaries = []
+            for uid in list(slot['available_users'])[:10]:
+                history = profiles[uid]
+                if history:
+                    user_summaries.append({
+                        'id': uid,
+                        'username': history.get('username', 'Unknown'),
+                        'club': history.get('club', 'Unknown'),
+                        'is_mentor': history.get('is_mentor', False),
+                        'total_bookings': history.get('total_bookings', 0),
+                        'attendance_rate': history.get('attendance_rate', 0.7)
+                    })
+            
+            slots_summary.append({
+                'index': idx,
+                'start_time': slot['start_time'].strftime('%Y-%m-%d %H:%M'),
+                'end_time': slot['end_time'].strftime('%H:%M'),
+                'day_of_week': slot['day_of_week'],
+                'hour': slot['hour'],
+                'available_count': slot['available_count'],
+                'users': user_summaries
+            })
+        return slots_summary
+    
+    def _score_with_llm(self, candidate_slots: List[Dict], system_prompt: str, user_prompt: str,
+                        cache_key: str, max_slots_to_analyze: int,
+                        on_slot_score: Optional[Callable[[Dict], None]] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Gửi prompt chấm điểm (format {"analysis", "slots": [{"index", "score", "reasoning"}]}),
+        dùng cache nếu có, lỗi thì fallback về điểm local.
+        Returns: (candidate_slots đã gắn điểm, analysis)
+        """
+        try:
+            result, complete = self._llm_result(system_prompt, user_prompt, cache_key, on_slot_score)
+            return (self._apply_gpt_scores(candidate_slots, result, max_slots_to_analyze,
+                                           partial=not complete),
+                    result.get('analysis'))
 
         except (json.JSONDecodeError, ValueError, Exception) as e:
             print(f"Lỗi xử lý Llama ({type(e).__name__}): {e}")
             
             print("Sử dụng fallback scoring...")
             for slot in candidate_slots:
-                slot['gpt_score'] = min(slot['available_count'] * 10, 100)
-                slot['gpt_reasoning'] = f'Fallback: {slot["available_count"]} người rảnh (Error)'
+                self._apply_fallback_score(slot)
                 
-            return candidate_slots
+            return candidate_slots, None
+    
+    def _llm_result(self, system_prompt: str, user_prompt: str, cache_key: str,
+                    on_slot_score: Optional[Callable[[Dict], None]] = None) -> Tuple[Dict, bool]:
+        """
+        Kết quả JSON của AI cho prompt, dùng cache nếu có (lỗi thì raise).
+        Returns: (result, complete) - complete=False nếu response bị cắt
+        """
+        result = self.response_cache.get(cache_key)
+        if result is not None:
+            print("Dùng kết quả AI từ cache")
+            return result, True
+        
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        if self.stream:
+            result, complete = self._stream_completion(messages, on_slot_score)
+        else:
+            result, complete = self._fetch_completion(messages), True
+        print(f"Analysis: {result.get('analysis', 'Done')}")
+        
+        # Không cache kết quả dở dang (response bị cắt)
+        if complete:
+            self.response_cache.set(cache_key, result)
+        return result, complete
+    
+    def _fetch_completion(self, messages: List[Dict]) -> Dict:
+        """
+        Gọi LLM không stream, chờ toàn bộ response rồi parse JSON
+        """
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=0.2,
+            stream=False
+        )
+        
+        response_text = response.choices[0].message.content
+        finish_reason = response.choices[0].finish_reason
+        
+        print(f"Llama Response length: {len(response_text)} chars")
+
+        if finish_reason == "length":
+            print("WARNING: Response bị truncate! Chuyển sang fallback.")
+            raise ValueError("Response truncated")
+        
+        return self._parse_response_json(response_text)
+    
+    def _stream_completion(self, messages: List[Dict],
+                           on_slot_score: Optional[Callable[[Dict], None]] = None) -> Tuple[Dict, bool]:
+        """
+        Gọi LLM dạng stream, parse dần mảng "slots" khi tokens về.
+        
+        Returns:
+            (result, complete): complete=False nếu chỉ có kết quả một phần
+            (response bị cắt hoặc JSON cuối cùng không hợp lệ)
+        """
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=0.2,
+            stream=True
+        )
+        
+        parser = SlotStreamParser()
+        finish_reason = None
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            text = choice.delta.content if choice.delta else None
+            if text:
+                for item in parser.feed(text):
+                    if on_slot_score:
+                        on_slot_score(item)
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+        
+        response_text = parser.buffer
+        print(f"Llama Response length: {len(response_text)} chars")
+        
+        if finish_reason == "length":
+            if not parser.slots:
+                print("WARNING: Response bị truncate! Chuyển sang fallback.")
+                raise ValueError("Response truncated")
+            print(f"WARNING: Response bị truncate! Giữ {len(parser.slots)} slots đã parse.")
+            return parser.partial_result(), False
+        
+        try:
+            return self._parse_response_json(response_text), True
+        except ValueError:
+            if not parser.slots:
+                raise
+            return parser.partial_result(), False
+    
+    def _parse_response_json(self, response_text: str) -> Dict:
+        json_match = re.search(r'\{[\s\S]*\}', response_text)
+        
+        if json_match:
+            clean_json_str = json_match.group(0)
+        else:
+            print(f"Raw response không chứa JSON hợp lệ: {response_text[:100]}...")
+            raise ValueError("No JSON found in response")
+
+        return json.loads(clean_json_str)
+    
+    def _apply_gpt_scores(self, candidate_slots: List[Dict], result: Dict,
+                          max_slots_to_analyze: int, partial: bool = False) -> List[Dict]:
+        """
+        Gắn điểm và lý do từ kết quả JSON của AI vào các slots.
+        Slots AI không chấm (response bị cắt hoặc thiếu index) giữ điểm local,
+        đánh dấu ai_scored=False để xếp sau mọi slot AI đã chấm (2 thang điểm khác nhau).
+        """
+        slot_scores_map = {item.get('index'): item for item in result.get('slots', [])}
+        for idx, slot in enumerate(candidate_slots[:max_slots_to_analyze]):
+            gpt_data = slot_scores_map.get(idx) 
+            
+            if gpt_data:
+                slot['gpt_score'] = gpt_data.get('score', 50)
+                slot['gpt_reasoning'] = gpt_data.get('reasoning', 'No reasoning')
+                slot['ai_scored'] = True
+            else:
+                self._apply_local_score(slot)
+                reason = 'response bị cắt' if partial else 'thiếu index'
+                slot['gpt_reasoning'] = f'AI chưa chấm ({reason}), điểm local: {slot["gpt_reasoning"]}'
+
+        return candidate_slots
+    
+    def _apply_fallback_score(self, slot: Dict):
+        self._apply_local_score(slot)
+        slot['gpt_reasoning'] = f'Fallback: {slot["gpt_reasoning"]} (Error)'
+    
+    def _apply_local_score(self, slot: Dict):
+        """Dùng điểm của LocalScorer (basic_score) thay cho điểm AI"""
+        slot['ai_scored'] = False
+        slot['gpt_score'] = int(round(slot.get('basic_score', 0)))
+        slot['gpt_reasoning'] = slot.get('local_reasoning') or f'{slot["available_count"]} người rảnh'
     
     # 5. Giải ràng buộc đa đối tượng
     
@@ -289,28 +638,42 @@ Chỉ trả về JSON. Lý do phải ngắn (max 15 từ)."""
         - max_attendees: Số người tối đa
         - preferred_members: List user IDs ưu tiên
         - club_filter: Chỉ members từ club cụ thể
+        - min_mentors: Số mentor (is_admin) tối thiểu phải rảnh
+        - expected_attendees: Số người dự kiến, dùng để chọn phòng đủ sức chứa
+          (mặc định = min_attendees)
         - time_constraints: Giới hạn khung giờ
         """
+        return self._check_constraints_mask(
+            slot_datetime, duration_minutes, mask_of(available_users), constraints
+        )
+    
+    def _check_constraints_mask(self, slot_datetime: datetime, duration_minutes: int,
+                                available_mask: int, constraints: Dict,
+                                membership: Optional[Membership] = None) -> Tuple[bool, Dict]:
+        """
+        check_constraints trên bitmask users rảnh (không tạo set)
+        """
         violations = {}
         
         # Check required members
-        required = set(constraints.get('required_members', []))
+        required = mask_of(constraints.get('required_members', []))
         if required:
-            missing_required = required - available_users
+            missing_required = required & ~available_mask
             if missing_required:
-                violations['missing_required'] = list(missing_required)
+                violations['missing_required'] = sorted(iter_ids(missing_required))
         
         # Check required mentors
-        required_mentors = set(constraints.get('required_mentors', []))
+        required_mentors = mask_of(constraints.get('required_mentors', []))
         if required_mentors:
-            missing_mentors = required_mentors - available_users
+            missing_mentors = required_mentors & ~available_mask
             if missing_mentors:
-                violations['missing_mentors'] = list(missing_mentors)
+                violations['missing_mentors'] = sorted(iter_ids(missing_mentors))
         
         # Check minimum attendees
         min_attendees = constraints.get('min_attendees', 0)
-        if len(available_users) < min_attendees:
-            violations['min_attendees'] = f"Need {min_attendees}, have {len(available_users)}"
+        available_count = popcount(available_mask)
+        if available_count < min_attendees:
+            violations['min_attendees'] = f"Need {min_attendees}, have {available_count}"
         
         # Check maximum attendees
         max_attendees = constraints.get('max_attendees', float('inf'))
@@ -332,18 +695,19 @@ Chỉ trả về JSON. Lý do phải ngắn (max 15 từ)."""
                 day_names = ['Thứ 2', 'Thứ 3', 'Thứ 4', 'Thứ 5', 'Thứ 6', 'Thứ 7', 'Chủ nhật']
                 violations['preferred_days'] = f"{day_names[slot_datetime.weekday()]} not in preferred days"
         
-        # Check club filter
+        # Check club filter / mentors: 1 phép AND với mask thành viên đã cache
         club_filter = constraints.get('club_filter')
-        if club_filter:
-            from app.models import User
-            available_club_members = set()
-            for uid in available_users:
-                user = User.query.get(uid)
-                if user and user.club == club_filter:
-                    available_club_members.add(uid)
+        min_mentors = constraints.get('min_mentors', 0)
+        if club_filter or min_mentors:
+            if membership is None:
+                membership = user_directory.membership(available_mask)
             
-            if not available_club_members:
+            if club_filter and not available_mask & membership.club_mask(club_filter):
                 violations['club_filter'] = f"No members from club {club_filter}"
+            
+            mentor_count = popcount(available_mask & membership.mentors) if min_mentors else 0
+            if mentor_count < min_mentors:
+                violations['min_mentors'] = f"Need {min_mentors} mentors, have {mentor_count}"
         
         is_valid = len(violations) == 0
         return is_valid, violations
@@ -373,34 +737,35 @@ Chỉ trả về JSON. Lý do phải ngắn (max 15 từ)."""
         if not is_valid:
             return -1000.0  # Penalty lớn cho slots không thỏa constraints
         
-        score = 0.0
-        if objective == 'max_attendance':
-            # Ưu tiên số lượng: Mỗi người +10 điểm
-            score += len(available_users) * 10
-        elif objective == 'efficiency':
-            # Ưu tiên slot vừa đủ (không quá đông, không quá vắng)
-            ideal_size = constraints.get('min_attendees', 3) + 2
-            diff = abs(len(available_users) - ideal_size)
-            score += max(50 - diff * 5, 0)
-        
-        # Bonus cho time slots hợp lý
-        hour = slot_datetime.hour
-        if 9 <= hour <= 11 or 14 <= hour <= 16:
-            score += 20
-        elif 8 <= hour <= 18: 
-            score += 10
-        else: 
-            score -= 10
-        
-        day = slot_datetime.weekday()
-        if day < 4:  # Thứ 2 - Thứ 5: Ưu tiên cao
-            score += 15
-        elif day == 4: # Thứ 6: Hơi thấp hơn chút (mọi người hay lười)
-            score += 10
-        else: # Cuối tuần
-            score -= 20 # Trừ điểm nặng nếu họp cuối tuần (trừ khi cần thiết)
-    
-        return score
+        scorer = self._request_scorer(constraints)
+        return scorer.score(slot_datetime, mask_of(available_users), objective)
+    
+    def _request_scorer(self, constraints: Dict) -> LocalScorer:
+        """LocalScorer theo constraints, tạo 1 lần trong request hiện tại rồi dùng lại cho mọi slot"""
+        self._sync_request()
+        scorers = getattr(self._local, 'scorers', None)
+        if scorers is None:
+            scorers = self._local.scorers = {}
+        key = json.dumps(constraints, sort_keys=True, default=str)
+        scorer = scorers.get(key)
+        if scorer is None:
+            scorer = scorers[key] = self.build_local_scorer(self._all_user_mask(), constraints)
+        return scorer
+    
+    def build_local_scorer(self, all_mask: int, constraints: Dict, days_ahead: int = 14) -> LocalScorer:
+        """
+        LocalScorer cho 1 request: profiles của users có thống kê booking
+        (đã memoize), mask mentor từ user_directory
+        """
+        membership = user_directory.membership(all_mask)
+        profiles = self.load_user_profiles()
+        return LocalScorer(
+            WEIGHTS, all_mask, membership.mentors & all_mask, profiles,
+            required_members=constraints.get('required_members', []),
+            preferred_members=constraints.get('preferred_members', []),
+            window_start=datetime.now(), days_ahead=days_ahead,
+            ideal_size=constraints.get('min_attendees', 3) + 2
+        )
     
     # Tìm top slots với AI
     
@@ -409,7 +774,9 @@ Chỉ trả về JSON. Lý do phải ngắn (max 15 từ)."""
                           objective: str = 'balanced',
                           days_ahead: int = 14,
                           top_n: int = 3,
-                          use_gpt: bool = True) -> List[Dict]:
+                          use_gpt: bool = True,
+                          progress: Optional[Callable[[str, Dict], None]] = None,
+                          slot_minutes: Optional[int] = None) -> List[Dict]:
         """
         TÌM VÀ ĐỀ XUẤT TOP N KHUNG GIỜ TỐT NHẤT
         
@@ -428,97 +795,157 @@ Chỉ trả về JSON. Lý do phải ngắn (max 15 từ)."""
             days_ahead: Số ngày trong tương lai để xét
             top_n: Số lượng slots đề xuất
             use_gpt: Có sử dụng GPT để phân tích hay không (default True)
+            progress: Callback(stage, data) báo tiến độ từng giai đoạn (xem app.ai.jobs.STAGES)
+            slot_minutes: Độ phân giải giờ bắt đầu (phút, ước của 60), mặc định Config.AGENT_SLOT_MINUTES
             
         Returns:
             List[Dict]: Top N slots với đầy đủ thông tin và reasoning từ GPT
         """
+        return self.find_optimal_slots_multi(
+            [objective], duration_minutes=duration_minutes, constraints=constraints,
+            days_ahead=days_ahead, top_n=top_n, use_gpt=use_gpt,
+            progress=progress, slot_minutes=slot_minutes
+        )[objective]
+    
+    def find_optimal_slots_multi(self, objectives: List[str],
+                                 duration_minutes: int = 60,
+                                 constraints: Optional[Dict] = None,
+                                 days_ahead: int = 14,
+                                 top_n: int = 3,
+                                 use_gpt: bool = True,
+                                 progress: Optional[Callable[[str, Dict], None]] = None,
+                                 slot_minutes: Optional[int] = None) -> Dict[str, List[Dict]]:
+        """
+        Như find_optimal_slots nhưng cho nhiều objectives cùng lúc: lưới và
+        tập candidate chỉ build/quét 1 lần, mỗi candidate được chấm điểm cho
+        mọi objective trong cùng 1 lượt (LocalScorer.score_many), mỗi objective
+        giữ top-K riêng. Các objectives cần AI được chấm chung trong 1 lần gọi.
+        
+        Returns:
+            Dict[str, List[Dict]]: {objective: top N slots}
+        """
         if constraints is None:
             constraints = {}
+        if progress is None:
+            progress = _no_progress
+        if slot_minutes is None:
+            from config import Config
+            slot_minutes = Config.AGENT_SLOT_MINUTES
+        if slot_minutes not in VALID_SLOT_MINUTES:
+            raise ValueError(f"slot_minutes must be one of {VALID_SLOT_MINUTES}")
+        objectives = list(dict.fromkeys(objectives))
         
         # 1. Lấy dữ liệu
         print("Đang lấy dữ liệu từ database...")
-        all_availabilities = self.get_all_user_availability()
-        self.get_booking_history()  # Load history
+        progress('loading_data', {})
+        self._reset_profiles()
         
-        # 2. Build availability grid
+        # 2. Build availability grid (từ template theo tuần đã cache)
         print("Đang xây dựng lưới availability...")
-        grid = self.build_availability_grid(all_availabilities, days_ahead)
+        progress('building_grid', {'days_ahead': days_ahead})
+        grid = self.build_availability_grid(None, days_ahead)
         
-        # 3. Tìm tất cả candidate slots
+        # 3. Tìm candidate slots, mỗi objective chỉ giữ top-K theo basic_score
         print("Đang tìm kiếm slots khả thi...")
-        candidate_slots = []
-        now = datetime.now()
-        min_start_time = now + timedelta(hours=2)  # Tối thiểu 2 tiếng sau thời điểm hiện tại
+        progress('scanning_candidates', {})
         today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        rooms = self.load_room_index(today, today + timedelta(days=days_ahead + 1))
         
-        for i in range(days_ahead):
-            current_date = today + timedelta(days=i)
-            date_str = current_date.strftime('%Y-%m-%d')
-            
-            for hour in range(WORKING_HOURS['start'], WORKING_HOURS['end']):
-                slot_start = current_date.replace(hour=hour, minute=0, second=0, microsecond=0)
-                slot_end = slot_start + timedelta(minutes=duration_minutes)
-                
-                # Bỏ qua nếu slot bắt đầu trước thời gian tối thiểu (hiện tại + 2 tiếng)
-                if slot_start < min_start_time:
-                    continue
-                
-                # Kiểm tra slot có đủ thời gian liên tục không
-                if not self._is_continuous_slot(grid, slot_start, slot_end):
-                    continue
-                
-                # Lấy available users cho slot này
-                available_users = self._get_available_users_for_slot(grid, slot_start, slot_end)
-                
-                if not available_users:
-                    continue
-                
-                # Check constraints
-                is_valid, violations = self.check_constraints(
-                    slot_start, duration_minutes, available_users, constraints
-                )
-                
-                if not is_valid:
-                    continue
-                # Chấm điểm cơ bản
-                basic_score = self.score_slot(
-                    slot_start, duration_minutes, available_users, constraints, objective
-                )
-                
-                
-                candidate_slots.append({
-                    'start_time': slot_start,
-                    'end_time': slot_end,
-                    'basic_score': basic_score,
-                    'available_users': list(available_users),
-                    'available_count': len(available_users),
-                    'date': date_str,
-                    'hour': hour,
-                    'day_of_week': slot_start.weekday(),
-                    'objective': objective
-                })
+        scorer = self.build_local_scorer(grid.all_mask, constraints, days_ahead)
+        keep = max(top_n, AI_CANDIDATE_SLOTS)
+        candidates = list(self._iter_candidates(
+            grid, rooms, days_ahead, duration_minutes, slot_minutes, constraints))
+        candidate_count = len(candidates)
+        # Chấm điểm local cả tập candidates cho mọi objective trong 1 lượt
+        columns = scorer.score_many([c[0] for c in candidates], [c[2] for c in candidates], objectives)
         
-        if not candidate_slots:
+        if not candidate_count:
             print("Không tìm thấy slots khả thi nào!")
-            return []
+            return {objective: [] for objective in objectives}
         
-        print(f"Tìm thấy {len(candidate_slots)} slots khả thi")
+        print(f"Tìm thấy {candidate_count} slots khả thi")
         
-        # 4. Sử dụng AI để phân tích (nếu enabled)
-        # print("OK")
-        sorted_slots = sorted(candidate_slots, key=lambda x: x['basic_score'], reverse=True)
-        slots_to_analyze_count = min(len(sorted_slots), 10) 
-        if use_gpt and slots_to_analyze_count > 0:
-            print(f"Gửi {slots_to_analyze_count} slots tốt nhất cho AI phân tích...")
-            
-            # Chỉ lấy top candidates để gửi đi
-            top_candidates_for_ai = sorted_slots[:slots_to_analyze_count]
-            
-            analyzed_slots = self.ask_gpt_to_analyze_slots(
-                top_candidates_for_ai, constraints, objective
-            )
-            
-            sorted_slots = sorted(analyzed_slots, key=lambda x: x.get('gpt_score', 0), reverse=True)
+        ranked = {}
+        for objective, column in columns.items():
+            sorted_slots = []
+            for i in _top_indexes(column, keep):
+                slot_start, slot_end, available_mask, room = candidates[i]
+                slot = self._candidate_dict(slot_start, slot_end, available_mask, room, column[i], objective)
+                slot['local_reasoning'] = scorer.explain(slot_start, available_mask)
+                sorted_slots.append(slot)
+            ranked[objective] = sorted_slots
+        
+        # 4. AI phân tích top candidates (tuỳ scoring_mode), mọi objective cần AI trong 1 lần gọi
+        to_analyze = {objective: sorted_slots[:AI_CANDIDATE_SLOTS] for objective, sorted_slots in ranked.items()
+                      if use_gpt and sorted_slots and self._needs_llm(sorted_slots, top_n)}
+        if to_analyze:
+            self._analyze_slots(to_analyze, constraints, candidate_count, progress)
+        
+        return {objective: self._finalize_slots(sorted_slots, top_n, objective in to_analyze)
+                for objective, sorted_slots in ranked.items()}
+    
+    def _candidate_dict(self, slot_start: datetime, slot_end: datetime, available_mask: int,
+                        room: RoomInfo, basic_score: float, objective: str) -> Dict:
+        return {
+            'start_time': slot_start,
+            'end_time': slot_end,
+            'basic_score': basic_score,
+            'available_users': sorted(iter_ids(available_mask)),
+            'available_count': popcount(available_mask),
+            'date': slot_start.strftime('%Y-%m-%d'),
+            'hour': slot_start.hour,
+            'day_of_week': slot_start.weekday(),
+            'objective': objective,
+            'room_id': room.id,
+            'room_name': room.name,
+            'room_capacity': room.capacity
+        }
+    
+    def _analyze_slots(self, candidates: Dict[str, List[Dict]], constraints: Dict,
+                       candidate_count: int, progress: Callable[[str, Dict], None]):
+        """
+        Bước 4: AI chấm top candidates của các objectives cần AI. Nhiều objectives
+        thì gộp vào 1 lần gọi (ask_gpt_to_analyze_objectives) thay vì mỗi objective
+        1 round trip. Điểm được gắn trực tiếp vào các slots.
+        """
+        for objective, top_candidates in candidates.items():
+            print(f"Gửi {len(top_candidates)} slots tốt nhất cho AI phân tích ({objective})...")
+            progress('ai_analysis', {'objective': objective,
+                                     'candidates': candidate_count,
+                                     'analyzing': len(top_candidates)})
+        
+        def on_slot_score(objective, idx, item):
+            top_candidates = candidates[objective]
+            if isinstance(idx, int) and 0 <= idx < len(top_candidates):
+                progress('ai_analysis', {'objective': objective, 'slot': {
+                    'index': idx,
+                    'start_time': top_candidates[idx]['start_time'].isoformat(),
+                    'score': item.get('score'),
+                    'reasoning': item.get('reasoning')
+                }})
+        
+        if len(candidates) > 1:
+            self.ask_gpt_to_analyze_objectives(candidates, constraints, on_slot_score=on_slot_score)
+            return
+        objective, top_candidates = next(iter(candidates.items()))
+        self.ask_gpt_to_analyze_slots(
+            top_candidates, constraints, objective,
+            on_slot_score=lambda item: on_slot_score(objective, item.get('index'), item)
+        )
+    
+    def _finalize_slots(self, sorted_slots: List[Dict], top_n: int, analyzed: bool) -> List[Dict]:
+        """
+        Bước 5-6: lấy top N và enrich. analyzed=True nếu AI đã chấm
+        AI_CANDIDATE_SLOTS slots đầu, không thì dùng luôn điểm local.
+        """
+        if analyzed:
+            # Slots AI đã chấm đứng trước, slots chỉ có điểm local xếp sau (sort ổn định)
+            sorted_slots = sorted(sorted_slots[:AI_CANDIDATE_SLOTS],
+                                  key=lambda x: (x.get('ai_scored', False), x.get('gpt_score', 0)),
+                                  reverse=True)
+        else:
+            for slot in sorted_slots:
+                self._apply_local_score(slot)
         
         # 5. Lấy top N
         top_slots = sorted_slots[:top_n]
@@ -527,54 +954,223 @@ Chỉ trả về JSON. Lý do phải ngắn (max 15 từ)."""
         print(f"Đề xuất {len(top_slots)} slots tốt nhất!")
         return self._enrich_slot_info(top_slots)
     
-    def _is_continuous_slot(self, grid: Dict, start_time: datetime, end_time: datetime) -> bool:
+    def plan_meetings(self, meetings: List[Dict], days_ahead: int = 7,
+                      use_gpt: bool = True,
+                      slot_minutes: Optional[int] = None,
+                      progress: Optional[Callable[[str, Dict], None]] = None) -> Dict:
         """
-        Kiểm tra slot có liên tục (không bị gián đoạn) không
-        """
-        current = start_time
-        while current < end_time:
-            date_str = current.strftime('%Y-%m-%d')
-            hour = current.hour
-            
-            if hour >= WORKING_HOURS['end']:
-                return False
-            
-            if date_str not in grid or hour not in grid[date_str]:
-                return False
+        XẾP LỊCH NHIỀU MEETINGS CÙNG LÚC (không trùng phòng, không trùng người)
+        
+        Lưới availability, index phòng và lịch sử chỉ load 1 lần cho cả lô.
+        Mỗi meeting lấy top candidates theo điểm local, sau đó BatchPlanner
+        xếp tham lam (meeting khó xếp trước) có sửa xung đột. Cả kế hoạch
+        được gửi cho AI trong 1 lần gọi duy nhất.
+        
+        Args:
+            meetings: List {"title", "duration_minutes", "constraints", "objective"}
+            days_ahead: Số ngày trong tương lai để xét
+            use_gpt: Có gửi kế hoạch cho AI đánh giá hay không
+            slot_minutes: Độ phân giải giờ bắt đầu (phút, ước của 60)
+            progress: Callback(stage, data) báo tiến độ
             
-            current += timedelta(hours=1)
+        Returns:
+            Dict: {"meetings": [...], "analysis": str | None} - mỗi phần tử
+            ứng với 1 meeting theo đúng thứ tự request, có "scheduled"
+        """
+        if progress is None:
+            progress = _no_progress
+        if slot_minutes is None:
+            from config import Config
+            slot_minutes = Config.AGENT_SLOT_MINUTES
+        if slot_minutes not in VALID_SLOT_MINUTES:
+            raise ValueError(f"slot_minutes must be one of {VALID_SLOT_MINUTES}")
+        
+        print(f"Đang xếp lịch cho {len(meetings)} meetings...")
+        progress('loading_data', {'meetings': len(meetings)})
+        self._reset_profiles()
+        
+        progress('building_grid', {'days_ahead': days_ahead})
+        grid = self.build_availability_grid(None, days_ahead)
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        rooms = self.load_room_index(today, today + timedelta(days=days_ahead + 1))
+        
+        progress('scanning_candidates', {})
+        batch = []
+        scorers = []
+        for index, meeting in enumerate(meetings):
+            constraints = meeting.get('constraints') or {}
+            duration = meeting.get('duration_minutes', 60)
+            objective = meeting.get('objective', 'balanced')
+            scorer = self.build_local_scorer(grid.all_mask, constraints, days_ahead)
+            scorers.append(scorer)
+            found = list(self._iter_candidates(grid, rooms, days_ahead, duration, slot_minutes, constraints))
+            column = scorer.score_many([c[0] for c in found], [c[2] for c in found], [objective])[objective]
+            candidates = [(column[i], found[i][0], found[i][1], found[i][2])
+                          for i in _top_indexes(column, BATCH_CANDIDATES)]
+            batch.append(BatchMeeting(
+                index, candidates,
+                score=lambda start, mask, scorer=scorer, objective=objective: scorer.score(start, mask, objective),
+                exclusive_mask=(mask_of(constraints.get('required_members', [])) |
+                                mask_of(constraints.get('required_mentors', []))),
+                min_attendees=constraints.get('min_attendees', 0),
+                min_capacity=_required_capacity(constraints)
+            ))
+            print(f"Meeting {index}: {len(candidates)} candidates")
+        
+        assigned, unscheduled = BatchPlanner(rooms, batch).plan()
+        
+        planned = []
+        for index in sorted(assigned):
+            assignment = assigned[index]
+            meeting = meetings[index]
+            slot = self._candidate_dict(assignment.start, assignment.end, assignment.mask,
+                                        assignment.room, assignment.score,
+                                        meeting.get('objective', 'balanced'))
+            slot['meeting_index'] = index
+            slot['title'] = meeting.get('title') or f'Meeting {index + 1}'
+            slot['local_reasoning'] = scorers[index].explain(assignment.start, assignment.mask)
+            planned.append(slot)
         
-        return True
+        analysis = None
+        if planned and use_gpt and self.scoring_mode != 'local':
+            progress('ai_analysis', {'meetings': len(planned)})
+            planned, analysis = self.ask_gpt_to_review_plan(planned, meetings)
+        else:
+            for slot in planned:
+                self._apply_local_score(slot)
+        
+        by_index = {slot['meeting_index']: slot for slot in self._enrich_slot_info(planned)}
+        results = []
+        for index, meeting in enumerate(meetings):
+            if index in by_index:
+                results.append({**by_index[index], 'scheduled': True})
+            else:
+                results.append({
+                    'meeting_index': index,
+                    'title': meeting.get('title') or f'Meeting {index + 1}',
+                    'scheduled': False,
+                    'reason': ('Không có slot nào thỏa constraints' if not batch[index].candidates
+                               else 'Mọi slot khả thi đều xung đột với meeting khác')
+                })
+        print(f"Đã xếp {len(planned)}/{len(meetings)} meetings")
+        return {'meetings': results, 'analysis': analysis}
+    
+    def ask_gpt_to_review_plan(self, planned: List[Dict], meetings: List[Dict]) -> Tuple[List[Dict], Optional[str]]:
+        """
+        1 lần gọi AI chấm điểm toàn bộ kế hoạch (mỗi meeting 1 điểm)
+        Returns: (planned đã gắn điểm, analysis)
+        """
+        print(f"Đang sử dụng ({self.model}) để đánh giá kế hoạch {len(planned)} meetings...")
+        plan_summary = []
+        for idx, slot in enumerate(planned):
+            meeting = meetings[slot['meeting_index']]
+            plan_summary.append({
+                'index': idx,
+                'title': slot['title'],
+                'objective': slot['objective'],
+                'constraints': meeting.get('constraints') or {},
+                'start_time': slot['start_time'].strftime('%Y-%m-%d %H:%M'),
+                'end_time': slot['end_time'].strftime('%H:%M'),
+                'day_of_week': slot['day_of_week'],
+                'room': slot['room_name'],
+                'available_count': slot['available_count'],
+                'local_summary': slot['local_reasoning']
+            })
+        
+        system_prompt = """Bạn là AI lập lịch họp. Đánh giá 1 kế hoạch gồm nhiều meetings đã được xếp không trùng phòng và mỗi người chỉ dự 1 meeting tại 1 thời điểm.
+        Chỉ trả về duy nhất 1 đối tượng JSON hợp lệ. Không được thêm bất kỳ JSON giải thích, văn bản hay markdown nào khác.
+
+Trả về JSON format BẮT BUỘC:
+{
+  "analysis": "1-2 câu nhận xét tổng thể về kế hoạch",
+  "slots": [
+    {"index": 0, "score": số nguyên từ 0-100(phải chấm điểm), "reasoning": "Lý do ngắn (max 20 từ)"}
+  ]
+}
+"""
+        
+        user_prompt = f"""Chấm điểm {len(plan_summary)} meetings trong kế hoạch sau (0-100 điểm):
+
+TRỌNG SỐ CHẤM ĐIỂM: {json.dumps(WEIGHTS, ensure_ascii=False)}
+
+KẾ HOẠCH:
+{json.dumps(plan_summary, ensure_ascii=False)}
+
+Chỉ trả về JSON. Lý do phải ngắn (max 15 từ)."""
+        
+        cache_key = self.response_cache.make_key(self.model, system_prompt, plan_summary, WEIGHTS)
+        return self._score_with_llm(planned, system_prompt, user_prompt, cache_key, len(planned))
+    
+    def _needs_llm(self, sorted_slots: List[Dict], top_n: int) -> bool:
+        """
+        'llm': luôn gọi AI, 'local': không bao giờ, 'hybrid': chỉ khi slot tốt nhất
+        và slot đầu tiên ngoài top N chênh nhau không quá ambiguity_margin điểm
+        """
+        if self.scoring_mode == 'llm':
+            return True
+        if self.scoring_mode == 'local' or len(sorted_slots) < 2:
+            return False
+        runner_up = sorted_slots[min(top_n, len(sorted_slots) - 1)]
+        ambiguous = sorted_slots[0]['basic_score'] - runner_up['basic_score'] <= self.ambiguity_margin
+        if not ambiguous:
+            print("Điểm local đã phân định rõ, bỏ qua AI")
+        return ambiguous
     
-    def _get_available_users_for_slot(self, grid: Dict, start_time: datetime, 
-                                     end_time: datetime) -> Set[int]:
+    def _iter_candidates(self, grid: AvailabilityGrid, rooms: RoomIntervalIndex, days_ahead: int,
+                         duration_minutes: int, slot_minutes: int, constraints: Dict):
         """
-        Lấy set users available trong TOÀN BỘ khoảng thời gian của slot
+        Generator các slot khả thi: (slot_start, slot_end, available_mask, room).
+        Required members/mentors và min_attendees được lọc bằng phép mask
+        trước khi tìm phòng hay kiểm tra các constraints còn lại.
         """
-        available_users = None
+        min_start_time = datetime.now() + timedelta(hours=2)  # Tối thiểu 2 tiếng sau thời điểm hiện tại
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        required_mask = (mask_of(constraints.get('required_members', [])) |
+                         mask_of(constraints.get('required_mentors', [])))
+        min_attendees = constraints.get('min_attendees', 0)
+        membership = user_directory.membership(grid.all_mask)
+        
+        # Chỉ giữ slots còn ít nhất 1 phòng đủ sức chứa đang trống
+        min_capacity = _required_capacity(constraints)
+        if min_capacity > rooms.max_capacity:
+            print(f"Không có phòng nào đủ {min_capacity} chỗ (lớn nhất: {rooms.max_capacity})")
+            return
         
-        current = start_time
-        while current < end_time:
-            date_str = current.strftime('%Y-%m-%d')
-            hour = current.hour
+        day_start_minutes = WORKING_HOURS['start'] * 60
+        for i in range(days_ahead):
+            current_date = today + timedelta(days=i)
+            date_str = current_date.strftime('%Y-%m-%d')
             
-            if date_str in grid and hour in grid[date_str]:
-                hour_available = grid[date_str][hour]['available_users']
+            # Sliding window: mask users rảnh cho mọi điểm bắt đầu cách nhau slot_minutes
+            for offset, available_mask in grid.scan_day(date_str, duration_minutes, slot_minutes):
+                if not available_mask or available_mask & required_mask != required_mask:
+                    continue
+                if min_attendees and popcount(available_mask) < min_attendees:
+                    continue
                 
-                if available_users is None:
-                    available_users = hour_available.copy()
-                else:
-                    available_users &= hour_available
-            
-            current += timedelta(hours=1)
-        
-        return available_users if available_users is not None else set()
+                slot_start = current_date + timedelta(minutes=day_start_minutes + offset)
+                # Bỏ qua nếu slot bắt đầu trước thời gian tối thiểu (hiện tại + 2 tiếng)
+                if slot_start < min_start_time:
+                    continue
+                
+                slot_end = slot_start + timedelta(minutes=duration_minutes)
+                room = rooms.find_free_room(slot_start, slot_end, min_capacity)
+                if room is None:
+                    continue
+                
+                is_valid, _ = self._check_constraints_mask(
+                    slot_start, duration_minutes, available_mask, constraints, membership
+                )
+                if is_valid:
+                    yield slot_start, slot_end, available_mask, room
     
     def _enrich_slot_info(self, slots: List[Dict]) -> List[Dict]:
         """
         Làm giàu thông tin slots để dễ hiển thị cho user
         """
-        from app.models import User, Booking
+        users = user_directory.get_many(
+            {uid for slot in slots for uid in slot['available_users']}
+        )
         
         enriched = []
         for slot in slots:
@@ -582,7 +1178,7 @@ Chỉ trả về JSON. Lý do phải ngắn (max 15 từ)."""
             
             user_details = []
             for uid in slot['available_users']:
-                user = User.query.get(uid)
+                user = users.get(uid)
                 if user:
                     user_details.append({
                         'id': uid,
@@ -610,23 +1206,34 @@ Chỉ trả về JSON. Lý do phải ngắn (max 15 từ)."""
         
         return enriched
     
+    def get_available_users_at(self, slot_datetime: datetime, duration_minutes: int) -> Set[int]:
+        """
+        Users rảnh trong suốt 1 khung giờ bất kỳ (kể cả xa hơn 30 ngày).
+        Chỉ xét các giờ làm việc mà slot đi qua.
+        """
+        all_mask = self._all_user_mask()
+        slot_end = slot_datetime + timedelta(minutes=duration_minutes)
+        return ids_of(self._available_mask_at(all_mask, slot_datetime, slot_end))
+    
+    def _available_mask_at(self, all_mask: int, start_time: datetime, end_time: datetime) -> int:
+        return self.get_weekly_template().available_mask(
+            all_mask, start_time, end_time, WORKING_HOURS['start'], WORKING_HOURS['end']
+        )
+    
     def get_busy_users_for_slot(self, slot_datetime: datetime, duration_minutes: int) -> Dict:
         """
         Lấy danh sách người bận và rảnh cho một khung giờ cụ thể
         """
-        from app.models import User, UserAvailability
+        from app.models import User
         
         # Lấy tất cả users
-        all_users = User.query.all()
-        all_user_ids = {u.id for u in all_users}
+        all_user_ids = {uid for (uid,) in self.db.query(User.id)}
+        users = user_directory.get_many(all_user_ids)
         
-        # Build availability grid cho khoảng thời gian này
-        availabilities = self.get_all_user_availability()
-        grid = self.build_availability_grid(availabilities, days_ahead=30)
-        
-        # Lấy available users cho slot
+        # Point query trên template theo tuần, không build lưới
+        template = self.get_weekly_template()
         slot_end = slot_datetime + timedelta(minutes=duration_minutes)
-        available_user_ids = self._get_available_users_for_slot(grid, slot_datetime, slot_end)
+        available_user_ids = ids_of(self._available_mask_at(mask_of(all_user_ids), slot_datetime, slot_end))
         
         # Tính busy users
         busy_user_ids = all_user_ids - available_user_ids
@@ -634,7 +1241,7 @@ Chỉ trả về JSON. Lý do phải ngắn (max 15 từ)."""
         # Get detailed info cho available users
         available_users = []
         for uid in available_user_ids:
-            user = User.query.get(uid)
+            user = users.get(uid)
             if user:
                 available_users.append({
                     'id': uid,
@@ -647,9 +1254,9 @@ Chỉ trả về JSON. Lý do phải ngắn (max 15 từ)."""
         # Get detailed info cho busy users
         busy_users = []
         for uid in busy_user_ids:
-            user = User.query.get(uid)
+            user = users.get(uid)
             if user:
-                reason = self._get_busy_reason(uid, slot_datetime, slot_end, availabilities)
+                reason = self._get_busy_reason(uid, slot_datetime, slot_end, template)
                 busy_users.append({
                     'id': uid,
                     'username': user.username,
@@ -671,29 +1278,90 @@ Chỉ trả về JSON. Lý do phải ngắn (max 15 từ)."""
         }
     
     def _get_busy_reason(self, user_id: int, start_time: datetime, 
-                        end_time: datetime, availabilities: List) -> str:
+                        end_time: datetime, template: WeeklyTemplate) -> str:
         """
         Tìm lý do tại sao user bận trong khung giờ này
         """
-        day_of_week = start_time.weekday()
-        start_hour = start_time.hour
-        end_hour = end_time.hour
-        
-        # Tìm availability record của user trong khung giờ này
-        for av in availabilities:
-            if av.user_id == user_id and av.day_of_week == day_of_week and av.is_busy:
-                # Check overlap
-                if not (av.end_hour <= start_hour or av.start_hour >= end_hour):
-                    if av.recurring:
-                        return f"Đã đánh dấu bận {av.start_hour}:00-{av.end_hour}:00 (định kỳ)"
-                    else:
-                        return f"Đã đánh dấu bận {av.start_hour}:00-{av.end_hour}:00"
+        # Tra index khoảng bận theo (user, thứ) của template, cùng các giờ mà
+        # available_mask xét: từ giờ bắt đầu đến giờ kết thúc làm tròn lên
+        if end_time.date() > start_time.date():
+            slot_end_hour = 24
+        else:
+            slot_end_hour = end_time.hour + bool(end_time.minute or end_time.second or end_time.microsecond)
+        interval = template.find_busy_interval(
+            user_id, start_time.weekday(), start_time.hour, slot_end_hour
+        )
+        if interval is not None:
+            start_hour, end_hour, recurring, _ = interval
+            if recurring:
+                return f"Đã đánh dấu bận {start_hour}:00-{end_hour}:00 (định kỳ)"
+            else:
+                return f"Đã đánh dấu bận {start_hour}:00-{end_hour}:00"
         
         return "Không rảnh trong khung giờ này"
 
 
 # HELPER FUNCTIONS
 
+def _no_progress(stage: str, data: Dict):
+    pass
+
+
+def _required_capacity(constraints: Dict) -> int:
+    """Sức chứa phòng tối thiểu cho meeting"""
+    return constraints.get('expected_attendees') or constraints.get('min_attendees', 0) or 0
+
+
+def _chunks(items: List, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _top_indexes(scores: List[float], k: int) -> List[int]:
+    """Index của k điểm cao nhất, giảm dần; cùng điểm thì slot quét trước đứng trước"""
+    return heapq.nlargest(k, range(len(scores)), key=lambda i: (scores[i], -i))
+
+
+_shared_agent = None
+_shared_agent_lock = threading.Lock()
+
+
+def _build_http_client():
+    """
+    HTTP client có connection pool + keep-alive, cấu hình qua Config
+    """
+    import httpx
+    from config import Config
+    
+    return DefaultHttpxClient(
+        limits=httpx.Limits(
+            max_connections=Config.AI_HTTP_POOL_SIZE,
+            max_keepalive_connections=Config.AI_HTTP_POOL_SIZE,
+            keepalive_expiry=Config.AI_HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(Config.AI_HTTP_TIMEOUT, connect=Config.AI_HTTP_CONNECT_TIMEOUT)
+    )
+
+
+def _request_token():
+    """Object đại diện cho request/app context hiện tại (None nếu ngoài app context)"""
+    if not has_app_context():
+        return None
+    return g.setdefault('agent_request', object())
+
+
+def get_agent() -> MeetingSchedulerAgent:
+    """
+    Lấy agent dùng chung của process (tạo lần đầu, thread-safe)
+    """
+    global _shared_agent
+    if _shared_agent is None:
+        with _shared_agent_lock:
+            if _shared_agent is None:
+                _shared_agent = create_agent()
+    return _shared_agent
+
+
 def create_agent(db_session=None, api_key=None, model=None):
     """
     Factory function để tạo agent instance với OpenAI
@@ -0,0 +1,342 @@
+"""
+Availability engine dạng bitmask
+
+Mỗi tập users được biểu diễn bằng 1 số nguyên Python: bit thứ `user_id` bật
+nghĩa là user đó có mặt trong tập. Giao giữa các khung giờ là phép AND,
+đếm số người là popcount.
+"""
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import threading
+
+from app.signals import availability_changed
+
+HOURS_PER_DAY = 24
+DAYS_PER_WEEK = 7
+
+
+def mask_of(user_ids: Iterable[int]) -> int:
+    """Chuyển tập user IDs thành bitmask"""
+    mask = 0
+    for uid in user_ids:
+        mask |= 1 << uid
+    return mask
+
+
+def iter_ids(mask: int) -> Iterator[int]:
+    """Duyệt các user IDs có bit bật trong mask (tăng dần)"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def ids_of(mask: int) -> Set[int]:
+    """Chuyển bitmask thành set user IDs"""
+    return set(iter_ids(mask))
+
+
+if hasattr(int, 'bit_count'):
+    def popcount(mask: int) -> int:
+        return mask.bit_count()
+else:  # Python < 3.10
+    def popcount(mask: int) -> int:
+        return bin(mask).count('1')
+
+
+class AvailabilityGrid:
+    """
+    Lưới thời gian biểu theo ngày và giờ, mỗi ô là bitmask users rảnh.
+
+    Vẫn hỗ trợ truy cập kiểu cũ `grid[date_str][hour]` (trả về dict
+    busy_users/available_users/total_users) cho code bên ngoài.
+    """
+
+    def __init__(self, all_mask: int, start_hour: int, end_hour: int):
+        self.all_mask = all_mask
+        self.total_users = popcount(all_mask)
+        self.start_hour = start_hour
+        self.end_hour = end_hour
+        self.days: Dict[str, List[int]] = {}
+        self._tables = {}
+
+    def set_day(self, date_str: str, available_masks: List[int]):
+        """Gán list mask rảnh cho 1 ngày, `available_masks[i]` ứng với giờ `start_hour + i`"""
+        self.days[date_str] = available_masks
+
+    def available_mask(self, date_str: str, hour: int) -> Optional[int]:
+        """Bitmask users rảnh trong 1 ô, None nếu ô nằm ngoài lưới"""
+        cells = self.days.get(date_str)
+        if cells is None or not self.start_hour <= hour < self.end_hour:
+            return None
+        return cells[hour - self.start_hour]
+
+    def scan_day(self, date_str: str, duration_minutes: int,
+                 slot_minutes: int = 60) -> Iterator[Tuple[int, int]]:
+        """
+        Sliding window trên trục thời gian của 1 ngày: với mỗi slot bắt đầu
+        cách nhau `slot_minutes` và nằm gọn trong giờ làm việc, yield
+        (số phút tính từ start_hour, bitmask users rảnh suốt slot).
+
+        AND của các giờ slot đi qua lấy từ sparse table (AND có tính lũy đẳng
+        nên 2 block chồng nhau là đủ), mỗi slot chỉ tốn O(1).
+        """
+        cells = self.days.get(date_str)
+        if cells is None or duration_minutes <= 0:
+            return
+        table = self._range_and_table(cells)
+        last_offset = len(cells) * 60 - duration_minutes
+        for offset in range(0, last_offset + 1, slot_minutes):
+            first = offset // 60
+            last = (offset + duration_minutes - 1) // 60
+            level = (last - first + 1).bit_length() - 1
+            row = table[level]
+            yield offset, row[first] & row[last - (1 << level) + 1]
+
+    def _range_and_table(self, cells: List[int]) -> List[List[int]]:
+        """Sparse table: table[k][i] = AND của cells[i : i + 2^k]"""
+        key = id(cells)
+        cached = self._tables.get(key)
+        if cached is not None and cached[0] is cells:
+            return cached[1]
+        table = [list(cells)]
+        span = 1
+        while span * 2 <= len(cells):
+            prev = table[-1]
+            table.append([prev[i] & prev[i + span] for i in range(len(cells) - span * 2 + 1)])
+            span *= 2
+        # Các ngày cùng thứ dùng chung list cells nên chỉ build 1 lần
+        self._tables[key] = (cells, table)
+        return table
+
+    def cell(self, date_str: str, hour: int) -> Dict:
+        available = self.available_mask(date_str, hour)
+        if available is None:
+            raise KeyError((date_str, hour))
+        return {
+            'busy_users': ids_of(self.all_mask & ~available),
+            'available_users': ids_of(available),
+            'total_users': self.total_users
+        }
+
+    def __contains__(self, date_str) -> bool:
+        return date_str in self.days
+
+    def __getitem__(self, date_str: str) -> '_GridDay':
+        if date_str not in self.days:
+            raise KeyError(date_str)
+        return _GridDay(self, date_str)
+
+    def __iter__(self):
+        return iter(self.days)
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+
+class _GridDay:
+    """View 1 ngày của AvailabilityGrid, giả lập dict {hour: cell}"""
+
+    __slots__ = ('grid', 'date_str')
+
+    def __init__(self, grid: AvailabilityGrid, date_str: str):
+        self.grid = grid
+        self.date_str = date_str
+
+    def __contains__(self, hour) -> bool:
+        return self.grid.start_hour <= hour < self.grid.end_hour
+
+    def __getitem__(self, hour: int) -> Dict:
+        return self.grid.cell(self.date_str, hour)
+
+    def __iter__(self):
+        return iter(range(self.grid.start_hour, self.grid.end_hour))
+
+    def __len__(self) -> int:
+        return self.grid.end_hour - self.grid.start_hour
+
+
+class WeeklyTemplate:
+    """
+    Lịch bận định kỳ theo tuần đã compile từ bảng UserAvailability.
+
+    - `user_weeks[uid]`: 7 x 24 bit, bit `day * 24 + hour` bật nếu user bận
+    - `busy[day][hour]`: bitmask users bận trong ô (day, hour)
+    - `intervals[(uid, day)]`: các khoảng bận (start_hour, end_hour, recurring, seq)
+      sắp theo start_hour, `seq` là thứ tự row gốc
+
+    Chiếu ra 1 khoảng ngày bất kỳ mà không phải đọc lại rows.
+    """
+
+    def __init__(self):
+        self.user_weeks: Dict[int, int] = {}
+        self.busy: List[List[int]] = [[0] * HOURS_PER_DAY for _ in range(DAYS_PER_WEEK)]
+        self.intervals: Dict[Tuple[int, int], List[Tuple]] = {}
+        self._interval_starts: Dict[Tuple[int, int], List[int]] = {}
+
+    @classmethod
+    def from_rows(cls, availabilities: Iterable) -> 'WeeklyTemplate':
+        template = cls()
+        for seq, av in enumerate(availabilities):
+            template._add_interval(av.user_id, av.day_of_week, av.start_hour, av.end_hour,
+                                   av.is_busy, av.recurring, seq)
+        
+        for key in template.intervals:
+            template._sort_intervals(key)
+        return template
+
+    def with_user(self, user_id: int, intervals: Iterable[Tuple]) -> 'WeeklyTemplate':
+        """
+        Template mới với lịch của `user_id` thay bằng `intervals`
+        ((day_of_week, start_hour, end_hour, is_busy, recurring), theo thứ tự row).
+        Template hiện tại không bị sửa (các thread khác có thể đang đọc).
+        """
+        template = WeeklyTemplate()
+        bit = 1 << user_id
+        template.busy = [[mask & ~bit for mask in day] for day in self.busy]
+        template.user_weeks = {uid: week for uid, week in self.user_weeks.items() if uid != user_id}
+        template.intervals = {key: value for key, value in self.intervals.items() if key[0] != user_id}
+        template._interval_starts = {key: value for key, value in self._interval_starts.items()
+                                     if key[0] != user_id}
+        # seq chỉ được so sánh giữa các khoảng của cùng 1 user
+        for seq, (day_of_week, start_hour, end_hour, is_busy, recurring) in enumerate(intervals):
+            template._add_interval(user_id, day_of_week, start_hour, end_hour, is_busy, recurring, seq)
+        for day_of_week in range(DAYS_PER_WEEK):
+            if (user_id, day_of_week) in template.intervals:
+                template._sort_intervals((user_id, day_of_week))
+        return template
+
+    def _add_interval(self, user_id: int, day_of_week: int, start_hour: int, end_hour: int,
+                      is_busy: bool, recurring: bool, seq: int):
+        if not is_busy or not 0 <= day_of_week < DAYS_PER_WEEK:
+            return
+        self.intervals.setdefault((user_id, day_of_week), []).append(
+            (start_hour, end_hour, recurring, seq)
+        )
+        bit = 1 << user_id
+        day_busy = self.busy[day_of_week]
+        week = self.user_weeks.get(user_id, 0)
+        base = day_of_week * HOURS_PER_DAY
+        for hour in range(max(start_hour, 0), min(end_hour, HOURS_PER_DAY)):
+            day_busy[hour] |= bit
+            week |= 1 << (base + hour)
+        if week:
+            self.user_weeks[user_id] = week
+
+    def _sort_intervals(self, key: Tuple[int, int]):
+        intervals = self.intervals[key]
+        intervals.sort()
+        self._interval_starts[key] = [interval[0] for interval in intervals]
+
+    def find_busy_interval(self, user_id: int, day_of_week: int,
+                           start_hour: int, end_hour: int) -> Optional[Tuple]:
+        """
+        Khoảng bận đầu tiên (theo thứ tự row gốc) của user giao với
+        [start_hour, end_hour) trong ngày `day_of_week`, None nếu không có
+        """
+        intervals = self.intervals.get((user_id, day_of_week))
+        if not intervals:
+            return None
+        # Chỉ các khoảng bắt đầu trước end_hour mới có thể giao nhau
+        hi = bisect_left(self._interval_starts[(user_id, day_of_week)], end_hour)
+        found = None
+        for interval in intervals[:hi]:
+            if interval[1] > start_hour and (found is None or interval[3] < found[3]):
+                found = interval
+        return found
+
+    def busy_mask(self, day_of_week: int, hour: int) -> int:
+        """Bitmask users bận tại (thứ, giờ)"""
+        return self.busy[day_of_week][hour]
+
+    def available_mask(self, all_mask: int, start_time: datetime, end_time: datetime,
+                       start_hour: int = 0, end_hour: int = HOURS_PER_DAY) -> int:
+        """
+        Point query: bitmask users rảnh trong suốt [start_time, end_time),
+        chỉ xét các giờ slot đi qua nằm trong [start_hour, end_hour).
+        Không cần build lưới, không giới hạn số ngày tới.
+        """
+        mask = None
+        current = start_time.replace(minute=0, second=0, microsecond=0)
+        while current < end_time:
+            if start_hour <= current.hour < end_hour:
+                free = all_mask & ~self.busy[current.weekday()][current.hour]
+                mask = free if mask is None else mask & free
+            current += timedelta(hours=1)
+        return mask if mask is not None else 0
+
+    def project(self, all_mask: int, start_date: datetime, days: int,
+                start_hour: int, end_hour: int) -> AvailabilityGrid:
+        """
+        Chiếu template lên `days` ngày kể từ `start_date`.
+        Mỗi thứ trong tuần chỉ tính mask 1 lần, các ngày cùng thứ dùng chung.
+        """
+        grid = AvailabilityGrid(all_mask, start_hour, end_hour)
+        by_weekday = {}
+        for i in range(days):
+            current_date = start_date + timedelta(days=i)
+            day_of_week = current_date.weekday()
+            available = by_weekday.get(day_of_week)
+            if available is None:
+                available = [all_mask & ~busy for busy in self.busy[day_of_week][start_hour:end_hour]]
+                by_weekday[day_of_week] = available
+            grid.set_day(current_date.strftime('%Y-%m-%d'), available)
+        return grid
+
+
+class WeeklyTemplateCache:
+    """
+    Giữ 1 WeeklyTemplate dùng chung trong process.
+    Compile lại sau khi `invalidate()` (khi user đổi lịch bận trong process này)
+    hoặc khi `version` truyền vào khác version lúc compile (đổi ở worker khác).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._template: Optional[WeeklyTemplate] = None
+        self._version = None
+        self.generation = 0
+
+    def get(self, load_rows: Callable[[], Iterable], version: Optional[int] = None) -> WeeklyTemplate:
+        template = self._template
+        if template is not None and (version is None or version == self._version):
+            return template
+        with self._lock:
+            if self._template is None or (version is not None and version != self._version):
+                self._template = WeeklyTemplate.from_rows(load_rows())
+                self._version = version
+            return self._template
+
+    def update_user(self, user_id: int, intervals: Iterable[Tuple], version: Optional[int] = None):
+        """
+        Cập nhật dần lịch của 1 user. Nếu template đang cache không phải bản
+        ngay trước `version` (đã lỡ thay đổi khác) thì chỉ invalidate.
+        """
+        with self._lock:
+            template = self._template
+            if template is None:
+                return
+            if version is not None and self._version is not None and version != self._version + 1:
+                self._template = None
+                self._version = None
+            else:
+                self._template = template.with_user(user_id, intervals)
+                self._version = version
+            self.generation += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._template = None
+            self._version = None
+            self.generation += 1
+
+
+weekly_templates = WeeklyTemplateCache()
+
+
+def _on_availability_changed(sender, user_id, intervals, version=None, **kwargs):
+    weekly_templates.update_user(user_id, intervals, version)
+
+
+availability_changed.connect(_on_availability_changed)
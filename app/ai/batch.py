@@ -0,0 +1,156 @@
+"""
+Xếp lịch nhiều meetings cùng lúc (vd cả tuần sinh hoạt của các club)
+
+Mỗi meeting có sẵn danh sách candidates (đã lọc constraints, sắp theo điểm
+local). Planner xếp theo thứ tự meeting ít lựa chọn nhất trước, chọn
+candidate tốt nhất không xung đột với các meeting đã xếp; nếu không còn
+candidate nào thì thử sửa (repair) bằng cách dời đúng 1 meeting đang chặn
+sang candidate khác của nó.
+
+Một người chỉ dự 1 meeting tại 1 thời điểm: người đã được xếp vào meeting
+trùng giờ bị bỏ khỏi danh sách tham dự của candidate và candidate được chấm
+lại với những người còn lại. Hai meeting trùng giờ xung đột khi dùng chung
+phòng, khi thành viên/mentor bắt buộc của meeting này đã dự meeting kia,
+hoặc khi phần người còn lại không đủ min_attendees (ít nhất 1 người).
+"""
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.ai.availability import popcount
+from app.ai.rooms import RoomInfo, RoomIntervalIndex
+
+
+class BatchMeeting:
+    """
+    Args:
+        index: Vị trí trong request
+        candidates: [(score, start, end, available_mask)] sắp giảm dần theo score
+        score: Chấm lại candidate (start, attendee_mask) khi bớt người đã dự meeting khác
+        exclusive_mask: Required members + mentors (bắt buộc có mặt)
+        min_attendees: Số người tối thiểu (constraint min_attendees)
+        min_capacity: Sức chứa phòng tối thiểu
+    """
+
+    __slots__ = ('index', 'candidates', 'score', 'exclusive_mask', 'min_attendees', 'min_capacity')
+
+    def __init__(self, index: int, candidates: List[Tuple[float, datetime, datetime, int]],
+                 score: Callable[[datetime, int], float], exclusive_mask: int = 0,
+                 min_attendees: int = 0, min_capacity: int = 0):
+        self.index = index
+        self.candidates = candidates
+        self.score = score
+        self.exclusive_mask = exclusive_mask
+        self.min_attendees = max(min_attendees, 1)
+        self.min_capacity = min_capacity
+
+
+class Assignment:
+    """mask: những người dự meeting này (không trùng với meeting nào khác cùng giờ)"""
+
+    __slots__ = ('meeting', 'score', 'start', 'end', 'mask', 'room')
+
+    def __init__(self, meeting: BatchMeeting, score: float, start: datetime, end: datetime,
+                 mask: int, room: RoomInfo):
+        self.meeting = meeting
+        self.score = score
+        self.start = start
+        self.end = end
+        self.mask = mask
+        self.room = room
+
+
+class BatchPlanner:
+    def __init__(self, rooms: RoomIntervalIndex, meetings: Sequence[BatchMeeting]):
+        self.rooms = rooms
+        self.meetings = list(meetings)
+        self.assigned: Dict[int, Assignment] = {}
+
+    def plan(self) -> Tuple[Dict[int, Assignment], List[int]]:
+        """
+        Returns:
+            (assigned, unscheduled): {meeting index: Assignment} và
+            các meeting index không xếp được
+        """
+        # Meeting ít candidates nhất (khó xếp nhất) đi trước
+        order = sorted(self.meetings, key=lambda m: (len(m.candidates), -popcount(m.exclusive_mask), m.index))
+        unscheduled = []
+        for meeting in order:
+            if not self._assign_best(meeting) and not self._repair(meeting):
+                unscheduled.append(meeting.index)
+        return self.assigned, sorted(unscheduled)
+
+    def _assign_best(self, meeting: BatchMeeting) -> bool:
+        """Candidate có điểm (chấm lại với người còn lại) cao nhất trong số không bị chặn"""
+        best = None
+        for candidate in meeting.candidates:
+            room, blockers, mask = self._place(meeting, candidate)
+            if room is None or blockers:
+                continue
+            assignment = self._assignment(meeting, candidate, mask, room)
+            if best is None or assignment.score > best.score:
+                best = assignment
+        if best is None:
+            return False
+        self.assigned[meeting.index] = best
+        return True
+
+    def _repair(self, meeting: BatchMeeting) -> bool:
+        """Dời 1 meeting đang chặn sang candidate khác để lấy chỗ cho `meeting`"""
+        for candidate in meeting.candidates:
+            room, blockers, _ = self._place(meeting, candidate)
+            if room is None or len(blockers) != 1:
+                continue
+            blocker = blockers[0]
+            del self.assigned[blocker.meeting.index]
+            # Tính lại người tham dự khi meeting chặn đã được dời đi
+            room, blockers, mask = self._place(meeting, candidate)
+            if room is not None and not blockers:
+                self.assigned[meeting.index] = self._assignment(meeting, candidate, mask, room)
+                if self._assign_best(blocker.meeting):
+                    return True
+                del self.assigned[meeting.index]
+            # Không dời được, trả lại như cũ
+            self.assigned[blocker.meeting.index] = blocker
+        return False
+
+    @staticmethod
+    def _assignment(meeting: BatchMeeting, candidate: Tuple[float, datetime, datetime, int],
+                    mask: int, room: RoomInfo) -> Assignment:
+        score, start, end, available_mask = candidate
+        if mask != available_mask:
+            score = meeting.score(start, mask)
+        return Assignment(meeting, score, start, end, mask, room)
+
+    def _place(self, meeting: BatchMeeting, candidate: Tuple[float, datetime, datetime, int]
+               ) -> Tuple[Optional[RoomInfo], List[Assignment], int]:
+        """
+        Chọn phòng và người tham dự cho candidate. Returns (room, blockers, mask):
+        mask là những người rảnh chưa dự meeting trùng giờ nào; blockers là các
+        meeting đã xếp trùng giờ đang giữ người bắt buộc, giữ phòng đã chọn, hoặc
+        lấy mất người khiến không đủ min_attendees.
+        """
+        _, start, end, available_mask = candidate
+        overlapping = [a for a in self.assigned.values()
+                       if a.meeting is not meeting and a.start < end and start < a.end]
+        taken = 0
+        for assignment in overlapping:
+            taken |= assignment.mask
+        mask = available_mask & ~taken
+
+        if meeting.exclusive_mask & taken:
+            blockers = [a for a in overlapping if a.mask & meeting.exclusive_mask]
+        elif popcount(mask) < meeting.min_attendees:
+            blockers = [a for a in overlapping if a.mask & available_mask]
+        else:
+            blockers = []
+
+        best = None
+        for room in self.rooms.free_rooms(start, end, meeting.min_capacity):
+            holders = [a for a in overlapping if a.room.id == room.id and a not in blockers]
+            if not holders:
+                return room, blockers, mask
+            if best is None or len(holders) < len(best[1]):
+                best = (room, holders)
+        if best is None:
+            return None, blockers, mask
+        return best[0], blockers + best[1], mask
@@ -0,0 +1,127 @@
+"""
+Danh bạ users trong bộ nhớ: id -> (username, email, club, is_admin)
+
+Load toàn bộ 1 lần rồi giữ ấm, IDs chưa có (vd user đăng ký ở worker khác)
+được nạp bằng 1 query `WHERE id IN (...)`. Gọi `invalidate()` khi có user
+mới hoặc user đổi thông tin.
+
+Kèm theo bitmask thành viên theo club và bitmask mentor (is_admin) để
+constraints club/mentor chỉ còn là 1 phép AND.
+"""
+from typing import Dict, Iterable, Optional
+import threading
+
+from app.ai.availability import iter_ids
+
+SQL_IN_CHUNK = 500  # Số IDs tối đa trong 1 mệnh đề IN (giới hạn biến của SQLite)
+
+
+class UserRecord:
+    __slots__ = ('id', 'username', 'email', 'club', 'is_admin')
+
+    def __init__(self, id: int, username: str, email: str, club: str, is_admin: bool):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.club = club
+        self.is_admin = is_admin
+
+    def __repr__(self):
+        return f'<UserRecord {self.username}>'
+
+
+class Membership:
+    """Bitmask users theo club và mentor, build từ 1 snapshot của directory"""
+
+    __slots__ = ('known', 'clubs', 'mentors')
+
+    def __init__(self, records: Dict[int, UserRecord]):
+        self.known = 0
+        self.clubs: Dict[str, int] = {}
+        self.mentors = 0
+        for uid, record in records.items():
+            bit = 1 << uid
+            self.known |= bit
+            self.clubs[record.club] = self.clubs.get(record.club, 0) | bit
+            if record.is_admin:
+                self.mentors |= bit
+
+    def club_mask(self, club: str) -> int:
+        return self.clubs.get(club, 0)
+
+
+class UserDirectory:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records: Optional[Dict[int, UserRecord]] = None
+        self._membership: Optional[Membership] = None
+        self._membership_source = None
+
+    def get_many(self, user_ids: Iterable[int]) -> Dict[int, UserRecord]:
+        """Trả về {id: UserRecord} cho các IDs tồn tại, không query từng user"""
+        records = self._ensure_loaded()
+        user_ids = list(user_ids)
+        missing = [uid for uid in user_ids if uid not in records]
+        if missing:
+            records = self._load_missing(missing)
+        return {uid: records[uid] for uid in user_ids if uid in records}
+
+    def get(self, user_id: int) -> Optional[UserRecord]:
+        return self.get_many([user_id]).get(user_id)
+
+    def membership(self, universe_mask: int = 0) -> Membership:
+        """
+        Masks club/mentor. `universe_mask` là các users cần có mặt
+        (vd toàn bộ users hiện tại), users chưa biết sẽ được nạp thêm.
+        """
+        records = self._ensure_loaded()
+        membership = self._membership
+        if membership is None or self._membership_source is not records:
+            membership = Membership(records)
+        unknown = universe_mask & ~membership.known
+        if unknown:
+            records = self._load_missing(list(iter_ids(unknown)))
+            membership = Membership(records)
+        with self._lock:
+            if self._records is records:
+                self._membership = membership
+                self._membership_source = records
+        return membership
+
+    def invalidate(self):
+        with self._lock:
+            self._records = None
+            self._membership = None
+            self._membership_source = None
+
+    def _ensure_loaded(self) -> Dict[int, UserRecord]:
+        records = self._records
+        if records is not None:
+            return records
+        with self._lock:
+            if self._records is None:
+                self._records = {row[0]: UserRecord(*row) for row in self._query()}
+            return self._records
+
+    def _load_missing(self, missing) -> Dict[int, UserRecord]:
+        loaded = {}
+        for i in range(0, len(missing), SQL_IN_CHUNK):
+            for row in self._query(missing[i:i + SQL_IN_CHUNK]):
+                loaded[row[0]] = UserRecord(*row)
+        with self._lock:
+            # Copy-on-write để các thread đang đọc không thấy dict bị sửa giữa chừng
+            records = dict(self._records or {})
+            records.update(loaded)
+            self._records = records
+            return records
+
+    @staticmethod
+    def _query(user_ids=None):
+        from app.models import User, db
+        query = db.session.query(User.id, User.username, User.email, User.club, User.is_admin)
+        if user_ids is not None:
+            query = query.filter(User.id.in_(user_ids))
+        return query.all()
+
+
+user_directory = UserDirectory()
@@ -0,0 +1,145 @@
+"""
+Chạy suggest-slots dưới dạng job nền
+
+POST trả về job id ngay, công việc chạy trên 1 executor giới hạn số thread,
+client poll trạng thái hoặc subscribe SSE để nhận tiến độ từng giai đoạn.
+Jobs được giữ trong bộ nhớ của process đã nhận POST.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+import threading
+import time
+import uuid
+
+STAGES = ['loading_data', 'building_grid', 'scanning_candidates', 'ai_analysis', 'done']
+
+
+class JobQueueFull(Exception):
+    """Executor đã đủ số job đang chờ/chạy"""
+
+
+class SchedulingJob:
+    def __init__(self, owner_id: Optional[int] = None):
+        self.id = uuid.uuid4().hex
+        self.owner_id = owner_id
+        self.status = 'queued'  # queued, running, done, failed
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.events: List[Dict] = []
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('done', 'failed')
+
+    def publish(self, stage: str, data: Optional[Dict] = None):
+        """Ghi nhận 1 sự kiện tiến độ và đánh thức các subscriber"""
+        with self._cond:
+            self.stage = stage
+            self.events.append({
+                'id': len(self.events) + 1,
+                'stage': stage,
+                'data': data or {},
+                'time': time.time()
+            })
+            self._cond.notify_all()
+
+    def finish(self, result: Optional[Dict] = None, error: Optional[str] = None):
+        with self._cond:
+            self.status = 'failed' if error else 'done'
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self.stage = 'done'
+            self.events.append({
+                'id': len(self.events) + 1,
+                'stage': 'done',
+                'data': {'status': self.status, 'error': error},
+                'time': self.finished_at
+            })
+            self._cond.notify_all()
+
+    def wait_events(self, after_id: int, timeout: float) -> List[Dict]:
+        """Chờ tới khi có sự kiện mới hơn `after_id` (hoặc hết timeout)"""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.events) > after_id, timeout=timeout)
+            return self.events[after_id:]
+
+    def to_dict(self) -> Dict:
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+
+class JobManager:
+    def __init__(self, max_workers: int = 2, max_pending: int = 20, ttl_seconds: float = 600):
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='suggest-slots')
+        self._jobs: Dict[str, SchedulingJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, work: Callable[[SchedulingJob], Dict], owner_id: Optional[int] = None) -> SchedulingJob:
+        """
+        Đưa job vào executor. `work(job)` trả về kết quả cuối cùng.
+        Raise JobQueueFull nếu đã có quá nhiều job chưa xong.
+        """
+        job = SchedulingJob(owner_id)
+        with self._lock:
+            self._prune()
+            active = sum(1 for j in self._jobs.values() if not j.finished)
+            if active >= self.max_pending:
+                raise JobQueueFull(f'Too many pending jobs ({active})')
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, work)
+        return job
+
+    def get(self, job_id: str) -> Optional[SchedulingJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job: SchedulingJob, work: Callable[[SchedulingJob], Dict]):
+        job.status = 'running'
+        try:
+            result = work(job)
+        except Exception as e:
+            print(f"Job {job.id} lỗi ({type(e).__name__}): {e}")
+            job.finish(error=str(e))
+        else:
+            job.finish(result=result)
+
+    def _prune(self):
+        """Xoá các job đã xong quá ttl_seconds"""
+        cutoff = time.time() - self.ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    """JobManager dùng chung của process (cấu hình qua Config)"""
+    global _job_manager
+    if _job_manager is None:
+        with _job_manager_lock:
+            if _job_manager is None:
+                from config import Config
+                _job_manager = JobManager(
+                    max_workers=Config.AGENT_JOB_WORKERS,
+                    max_pending=Config.AGENT_JOB_MAX_PENDING,
+                    ttl_seconds=Config.AGENT_JOB_TTL
+                )
+    return _job_manager
@@ -0,0 +1,145 @@
+"""
+Cache kết quả chấm điểm của LLM theo nội dung prompt
+
+- Key: sha256 của các thành phần prompt (model, slots, constraints, objective, WEIGHTS...)
+- Lớp 1: in-memory LRU có TTL (mỗi process)
+- Lớp 2 (tuỳ chọn): SQLite trên đĩa, dùng chung giữa các gunicorn workers
+"""
+from collections import OrderedDict
+from typing import Dict, Optional
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class LLMResponseCache:
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600,
+                 db_path: Optional[str] = None, max_disk_entries: int = 5000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'memory_hits': 0, 'disk_hits': 0, 'writes': 0}
+        if db_path:
+            self._init_disk()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Hash nội dung các thành phần prompt thành cache key"""
+        payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_entries > 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    self._counters['memory_hits'] += 1
+                    return value
+                del self._entries[key]
+
+        value = self._disk_get(key, now) if self.db_path else None
+        with self._lock:
+            if value is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['hits'] += 1
+            self._counters['disk_hits'] += 1
+            self._remember(key, value, now + self.ttl_seconds)
+        return value
+
+    def set(self, key: str, value: Dict):
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._remember(key, value, expires_at)
+            self._counters['writes'] += 1
+        if self.db_path:
+            self._disk_set(key, value, expires_at)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.db_path:
+            with self._connect() as conn:
+                conn.execute('DELETE FROM llm_cache')
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        stats['disk'] = bool(self.db_path)
+        return stats
+
+    def _remember(self, key: str, value: Dict, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # Lớp SQLite
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _init_disk(self):
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_llm_cache_last_access ON llm_cache (last_access)')
+
+    def _disk_get(self, key: str, now: float) -> Optional[Dict]:
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    'SELECT value FROM llm_cache WHERE key = ? AND expires_at > ?', (key, now)
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute('UPDATE llm_cache SET last_access = ? WHERE key = ?', (now, key))
+                return json.loads(row[0])
+        except sqlite3.Error as e:
+            print(f"LLM cache (disk) lỗi khi đọc: {e}")
+            return None
+
+    def _disk_set(self, key: str, value: Dict, expires_at: float):
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO llm_cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)',
+                    (key, json.dumps(value, ensure_ascii=False), expires_at, now)
+                )
+                # Dọn entries hết hạn và giữ tối đa max_disk_entries (LRU)
+                conn.execute('DELETE FROM llm_cache WHERE expires_at <= ?', (now,))
+                conn.execute('''
+                    DELETE FROM llm_cache WHERE key IN (
+                        SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                    )
+                ''', (self.max_disk_entries,))
+        except sqlite3.Error as e:
+            print(f"LLM cache (disk) lỗi khi ghi: {e}")
@@ -0,0 +1,96 @@
+"""
+Index các khoảng đã đặt của từng phòng
+
+Mỗi phòng giữ danh sách booking đã sắp theo giờ bắt đầu cùng prefix-max
+của giờ kết thúc, nên kiểm tra 1 khoảng có trống hay không chỉ cần 1 bisect.
+"""
+from bisect import bisect_left
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+class RoomInfo:
+    __slots__ = ('id', 'name', 'capacity')
+
+    def __init__(self, id: int, name: str, capacity: int):
+        self.id = id
+        self.name = name
+        self.capacity = capacity
+
+
+class _RoomSchedule:
+    __slots__ = ('starts', 'ends', 'max_ends')
+
+    def __init__(self):
+        self.starts: List[datetime] = []
+        self.ends: List[datetime] = []
+        self.max_ends: List[datetime] = []  # max_ends[i] = max(ends[:i + 1])
+
+    def add(self, start: datetime, end: datetime):
+        pos = bisect_left(self.starts, start)
+        self.starts.insert(pos, start)
+        self.ends.insert(pos, end)
+        # Tính lại prefix-max từ vị trí chèn
+        running = self.max_ends[pos - 1] if pos > 0 else None
+        del self.max_ends[pos:]
+        for i in range(pos, len(self.ends)):
+            running = self.ends[i] if running is None or self.ends[i] > running else running
+            self.max_ends.append(running)
+
+    def is_free(self, start: datetime, end: datetime) -> bool:
+        # Chỉ các booking bắt đầu trước `end` mới có thể giao với [start, end)
+        hi = bisect_left(self.starts, end)
+        return hi == 0 or self.max_ends[hi - 1] <= start
+
+
+class RoomIntervalIndex:
+    def __init__(self, rooms: Iterable[Tuple[int, str, int]]):
+        # Phòng nhỏ trước để slot dùng phòng vừa đủ, chừa phòng lớn
+        self.rooms = sorted((RoomInfo(*room) for room in rooms), key=lambda r: (r.capacity, r.id))
+        self._schedules = {room.id: _RoomSchedule() for room in self.rooms}
+
+    @classmethod
+    def from_bookings(cls, rooms: Iterable[Tuple[int, str, int]],
+                      bookings: Iterable[Tuple[int, datetime, datetime]]) -> 'RoomIntervalIndex':
+        index = cls(rooms)
+        by_room = {}
+        for room_id, start, end in bookings:
+            by_room.setdefault(room_id, []).append((start, end))
+        for room_id, intervals in by_room.items():
+            schedule = index._schedules.get(room_id)
+            if schedule is None:
+                continue
+            intervals.sort()
+            schedule.starts = [start for start, _ in intervals]
+            schedule.ends = [end for _, end in intervals]
+            running = None
+            for end in schedule.ends:
+                running = end if running is None or end > running else running
+                schedule.max_ends.append(running)
+        return index
+
+    def add_booking(self, room_id: int, start: datetime, end: datetime):
+        """Cập nhật index khi có thêm 1 booking (hoặc 1 slot vừa được xếp)"""
+        schedule = self._schedules.get(room_id)
+        if schedule is not None:
+            schedule.add(start, end)
+
+    def is_free(self, room_id: int, start: datetime, end: datetime) -> bool:
+        schedule = self._schedules.get(room_id)
+        return schedule is not None and schedule.is_free(start, end)
+
+    def find_free_room(self, start: datetime, end: datetime,
+                       min_capacity: int = 0) -> Optional[RoomInfo]:
+        """Phòng nhỏ nhất đủ sức chứa và còn trống trong [start, end)"""
+        return next(self.free_rooms(start, end, min_capacity), None)
+
+    def free_rooms(self, start: datetime, end: datetime,
+                   min_capacity: int = 0) -> Iterator[RoomInfo]:
+        """Các phòng đủ sức chứa và còn trống trong [start, end), nhỏ trước"""
+        for room in self.rooms:
+            if room.capacity >= min_capacity and self._schedules[room.id].is_free(start, end):
+                yield room
+
+    @property
+    def max_capacity(self) -> int:
+        return self.rooms[-1].capacity if self.rooms else 0
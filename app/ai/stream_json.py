@@ -0,0 +1,97 @@
+"""
+Parse dần mảng "slots" trong JSON trả về từ LLM khi đang stream
+
+Mỗi object trong mảng được trả ra ngay khi đóng ngoặc, không cần chờ
+toàn bộ response. Nếu response bị cắt giữa chừng vẫn giữ được các slots
+đã hoàn chỉnh.
+"""
+from typing import Dict, List, Optional
+import json
+import re
+
+_SLOTS_ARRAY_RE = re.compile(r'"slots"\s*:\s*\[')
+_ANALYSIS_RE = re.compile(r'"analysis"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+class SlotStreamParser:
+    def __init__(self):
+        self.buffer = ''
+        self.slots: List[Dict] = []
+        self.array_done = False
+        self._pos = None  # vị trí đang quét trong mảng slots (None = chưa thấy mảng)
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item_start = None
+
+    def feed(self, text: str) -> List[Dict]:
+        """Thêm 1 đoạn text, trả về các slot object mới hoàn chỉnh"""
+        self.buffer += text
+        if self.array_done:
+            return []
+
+        if self._pos is None:
+            match = _SLOTS_ARRAY_RE.search(self.buffer)
+            if not match:
+                return []
+            self._pos = match.end()
+
+        new_items = []
+        buffer = self.buffer
+        i = self._pos
+        while i < len(buffer):
+            ch = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                if self._depth == 0 and ch == '{':
+                    self._item_start = i
+                self._depth += 1
+            elif ch in '}]':
+                if self._depth == 0:
+                    # ']' đóng mảng slots
+                    self.array_done = True
+                    i += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._item_start is not None:
+                    item = self._parse_item(buffer[self._item_start:i + 1])
+                    if item is not None:
+                        self.slots.append(item)
+                        new_items.append(item)
+                    self._item_start = None
+            i += 1
+        self._pos = i
+        return new_items
+
+    @property
+    def analysis(self) -> Optional[str]:
+        match = _ANALYSIS_RE.search(self.buffer)
+        if not match:
+            return None
+        try:
+            return json.loads(match.group(1))
+        except json.JSONDecodeError:
+            return None
+
+    def partial_result(self) -> Dict:
+        """Kết quả từ các phần đã parse được (dùng khi response bị cắt)"""
+        return {
+            'analysis': self.analysis or 'Partial response',
+            'slots': list(self.slots)
+        }
+
+    @staticmethod
+    def _parse_item(text: str) -> Optional[Dict]:
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        return item if isinstance(item, dict) else None
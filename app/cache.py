@@ -0,0 +1,216 @@
+"""
+Bộ đếm thay đổi theo bảng + cache response JSON cho các API đọc
+
+Mỗi transaction có flush/bulk insert/update/delete chạm vào bảng trong
+VERSIONED_TABLES tăng bộ đếm của bảng đó (TableVersion) đúng 1 lần, ngay
+trong transaction đang ghi.
+Các worker đọc snapshot bộ đếm (giữ tối đa TABLE_VERSION_TTL giây, ghi
+trong chính process thì làm mới ngay) để:
+- tính ETag: client gửi If-None-Match khớp thì trả 304, không query dữ liệu
+- làm khóa cho cache bytes JSON đã serialize (LRU trong process)
+"""
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Callable, Dict, Iterable, Optional, Tuple
+import hashlib
+import threading
+import time
+
+from flask import Response, current_app, request
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.models import TableVersion, db
+
+VERSIONED_TABLES = ('booking', 'room', 'user_availability', 'user', 'booking_counter')
+
+
+class TableVersions:
+    """Snapshot {table: (version, updated_at)} đọc từ DB, làm mới sau ttl giây"""
+
+    def __init__(self, ttl_seconds: Optional[float] = None):
+        self._ttl = ttl_seconds
+        self._lock = threading.Lock()
+        self._snapshot: Dict[str, Tuple[int, datetime]] = {}
+        self._loaded_at = 0.0
+
+    @property
+    def ttl(self) -> float:
+        if self._ttl is None:
+            from config import Config
+            self._ttl = Config.TABLE_VERSION_TTL
+        return self._ttl
+
+    def snapshot(self) -> Dict[str, Tuple[int, datetime]]:
+        snapshot = self._snapshot
+        if time.monotonic() - self._loaded_at < self.ttl:
+            return snapshot
+        rows = db.session.query(TableVersion.table_name, TableVersion.version,
+                                TableVersion.updated_at).all()
+        snapshot = {name: (version, updated_at) for name, version, updated_at in rows}
+        with self._lock:
+            self._snapshot = snapshot
+            self._loaded_at = time.monotonic()
+        return snapshot
+
+    def get(self, table: str) -> int:
+        return self.snapshot().get(table, (0, None))[0]
+
+    def expire(self):
+        """Đọc lại từ DB ở lần kế tiếp (sau khi process này vừa ghi)"""
+        self._loaded_at = 0.0
+
+
+class ResponseCache:
+    """LRU bytes JSON theo khóa (endpoint, user, tham số, versions)"""
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self._max_entries = max_entries
+        self._entries: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_entries(self) -> int:
+        if self._max_entries is None:
+            from config import Config
+            self._max_entries = Config.API_CACHE_MAX_ENTRIES
+        return self._max_entries
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def set(self, key: str, body: bytes):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+table_versions = TableVersions()
+response_cache = ResponseCache()
+
+
+def cached_json(tables: Iterable[str], build: Callable[[], object], *key_parts) -> Response:
+    """
+    Trả về JSON của build() với ETag/Last-Modified theo version các bảng phụ thuộc.
+    If-None-Match khớp -> 304; đã có bytes cho version hiện tại -> trả luôn,
+    không gọi build(). key_parts phân biệt các biến thể (user, query args...).
+    """
+    snapshot = table_versions.snapshot()
+    tables = tuple(tables)
+    versions = tuple(snapshot.get(table, (0, None))[0] for table in tables)
+    key = hashlib.sha1(repr((request.endpoint, key_parts, tables, versions)).encode('utf-8')).hexdigest()
+
+    if key in request.if_none_match:
+        response = Response(status=304)
+    else:
+        body = response_cache.get(key)
+        if body is None:
+            body = current_app.json.dumps(build()).encode('utf-8')
+            response_cache.set(key, body)
+        response = Response(body, mimetype='application/json')
+
+    response.set_etag(key)
+    modified = [snapshot[table][1] for table in tables if table in snapshot]
+    if modified:
+        response.headers['Last-Modified'] = format_datetime(max(modified).replace(tzinfo=timezone.utc), usegmt=True)
+    # Trình duyệt luôn hỏi lại server (rẻ nhờ ETag), không dùng bản cũ
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def _bump(connection, tables):
+    now = datetime.utcnow()
+    for table in tables:
+        result = connection.execute(
+            update(TableVersion.__table__)
+            .where(TableVersion.__table__.c.table_name == table)
+            .values(version=TableVersion.__table__.c.version + 1, updated_at=now)
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(TableVersion.__table__).values(
+                table_name=table, version=1, updated_at=now))
+
+
+def _changed_tables(objects) -> set:
+    tables = set()
+    for obj in objects:
+        table = getattr(obj, '__tablename__', None)
+        if table in VERSIONED_TABLES:
+            tables.add(table)
+    return tables
+
+
+def _bump_once(session, tables):
+    """Mỗi bảng chỉ tăng 1 lần trong 1 transaction"""
+    bumped = session.info.setdefault('bumped_tables', set())
+    pending = sorted(set(tables) - bumped)
+    if pending:
+        _bump(session.connection(), pending)
+        bumped.update(pending)
+
+
+def _after_flush(session, flush_context):
+    tables = _changed_tables(session.new) | _changed_tables(session.dirty) | _changed_tables(session.deleted)
+    if tables:
+        _bump_once(session, tables)
+
+
+def _do_orm_execute(orm_execute_state):
+    # Bulk insert/update/delete (session.execute, query.delete()) không đi qua flush
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    table = mapper.local_table.name if mapper is not None else None
+    if table in VERSIONED_TABLES:
+        _bump_once(orm_execute_state.session, [table])
+
+
+def _after_commit(session):
+    if session.info.pop('bumped_tables', None):
+        table_versions.expire()
+
+
+def _after_rollback(session):
+    session.info.pop('bumped_tables', None)
+
+
+def register_version_listeners():
+    """Gắn các hook tăng bộ đếm vào mọi Session (gọi 1 lần trong create_app)"""
+    for name, listener in (('after_flush', _after_flush),
+                           ('do_orm_execute', _do_orm_execute),
+                           ('after_commit', _after_commit),
+                           ('after_rollback', _after_rollback)):
+        if not event.contains(Session, name, listener):
+            event.listen(Session, name, listener)
+
+
+def current_version(table: str) -> int:
+    """Bộ đếm của bảng đọc trực tiếp trong transaction hiện tại (kể cả phần chưa commit)"""
+    return db.session.query(TableVersion.version).filter_by(table_name=table).scalar() or 0
+
+
+def seed_table_versions(connection):
+    """
+    Tạo sẵn các dòng TableVersion còn thiếu (tránh 2 worker cùng INSERT lần đầu).
+    Chạy 1 lần trong migration (xem app.migrations); thêm bảng vào VERSIONED_TABLES
+    thì thêm 1 migration gọi lại hàm này.
+    """
+    table = TableVersion.__table__
+    existing = {name for (name,) in connection.execute(select(table.c.table_name))}
+    missing = [name for name in VERSIONED_TABLES if name not in existing]
+    if missing:
+        connection.execute(insert(table), [{'table_name': name, 'version': 0} for name in missing])
@@ -0,0 +1,116 @@
+"""
+Lệnh bảo trì chạy qua Flask CLI, vd:
+    flask --app run rebuild-profiles
+    flask --app run rebuild-stats
+    flask --app run upgrade-db
+    flask --app run check-query-plans
+"""
+from datetime import datetime, timedelta
+import sys
+
+import click
+
+
+def register_commands(app):
+    @app.cli.command('rebuild-profiles')
+    def rebuild_profiles():
+        """Tính lại toàn bộ UserProfileStats từ bảng Booking"""
+        from app.models import UserProfileStats
+        count = UserProfileStats.rebuild_all()
+        click.echo(f'Đã rebuild thống kê booking cho {count} users')
+
+    @app.cli.command('rebuild-stats')
+    def rebuild_stats():
+        """Tính lại BookingCounter và RoomHourUtilization từ bảng Booking"""
+        from app.models import BookingCounter
+        count = BookingCounter.rebuild_all()
+        click.echo(f'Đã rebuild thống kê từ {count} bookings confirmed')
+
+    @app.cli.command('upgrade-db')
+    def upgrade_db():
+        """Áp dụng các migrations schema chưa chạy"""
+        from app.migrations import current_version, run_migrations
+        from app.models import db
+        applied = run_migrations(db.engine)
+        with db.engine.connect() as connection:
+            version = current_version(connection)
+        click.echo(f'Schema version {version}' + (f' (vừa áp dụng {applied})' if applied else ''))
+
+    @app.cli.command('check-query-plans')
+    def check_query_plans():
+        """EXPLAIN QUERY PLAN các query nóng, lỗi (exit 1) nếu có query phải scan cả bảng
+        hoặc dùng index thời gian chỉ với cận trên"""
+        from app.models import db
+        if db.engine.dialect.name != 'sqlite':
+            click.echo(f'Bỏ qua: chỉ hỗ trợ SQLite (đang dùng {db.engine.dialect.name})')
+            return
+        failures = 0
+        for name, statement in _hot_queries():
+            plan = _explain(db, statement)
+            scans = [detail for detail in plan if _is_table_scan(detail)]
+            unbounded = [detail for detail in plan if _is_unbounded_window(detail)]
+            status = 'SCAN' if scans else 'UNBOUNDED' if unbounded else 'OK'
+            click.echo(f'[{status}] {name}')
+            for detail in plan:
+                click.echo(f'    {detail}')
+            failures += bool(scans or unbounded)
+        if failures:
+            click.echo(f'{failures} lỗi', err=True)
+            sys.exit(1)
+
+
+def _hot_queries():
+    """Các query cần index (cùng dạng với code trong routes và agent)"""
+    from sqlalchemy import func, select
+    from app.models import Booking, UserAvailability, UserProfileSlot
+    now = datetime.utcnow()
+    later = now + timedelta(hours=1)
+    return [
+        ('Kiểm tra trùng phòng (booking.create, check-availability)',
+         select(Booking.id).where(Booking.room_id == 1, *Booking.overlaps(now, later),
+                                  Booking.status == 'confirmed')),
+        ('Bookings confirmed của 1 user (my-events)',
+         select(Booking.id).where(Booking.user_id == 1, Booking.status == 'confirmed')),
+        ('Đếm bookings theo user và trạng thái',
+         select(func.count(Booking.id)).where(Booking.user_id == 1, Booking.status == 'confirmed')),
+        ('Bookings ngày đầu cửa sổ lịch sử (profiles của agent)',
+         select(Booking.user_id).where(Booking.status == 'confirmed',
+                                       Booking.start_time >= now - timedelta(days=90),
+                                       Booking.start_time < now - timedelta(days=89))),
+        ('Histogram theo ngày trong cửa sổ lịch sử (profiles của agent)',
+         select(UserProfileSlot.user_id).where(UserProfileSlot.day >= '2000-01-01',
+                                               UserProfileSlot.count > 0)),
+        ('Bookings trong khoảng hiển thị (calendar, index phòng của agent)',
+         select(Booking.id).where(Booking.status == 'confirmed', *Booking.overlaps(now, later))),
+        ('Lịch rảnh/bận của 1 user',
+         select(UserAvailability.id).where(UserAvailability.user_id == 1)),
+        ('Lịch rảnh/bận của 1 user theo ngày',
+         select(UserAvailability.id).where(UserAvailability.user_id == 1,
+                                           UserAvailability.day_of_week == 0)),
+    ]
+
+
+def _explain(db, statement):
+    compiled = statement.compile(dialect=db.engine.dialect)
+    params = compiled.construct_params()
+    values = [params[key] for key in compiled.positiontup]
+    values = [value.isoformat(' ') if isinstance(value, datetime) else value for value in values]
+    with db.engine.connect() as connection:
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', tuple(values)).all()
+    return [row[-1] for row in rows]
+
+
+def _is_table_scan(detail):
+    # "SEARCH ... USING INDEX" là tốt; "SCAN <table>" (kể cả qua index) là duyệt cả bảng
+    words = detail.split()
+    return len(words) >= 2 and words[0] == 'SCAN' and words[1] in ('booking', 'user_availability',
+                                                                   'user_profile_slot')
+
+
+def _is_unbounded_window(detail):
+    # "SEARCH booking USING INDEX ... (status=? AND start_time<?)": chỉ có cận trên nên
+    # đọc toàn bộ lịch sử phía trước; khoảng thời gian phải có cận dưới (vd end_time>?)
+    if not detail.startswith('SEARCH booking'):
+        return False
+    return any(f'{column}<' in detail and f'{column}>' not in detail
+               for column in ('start_time', 'end_time'))
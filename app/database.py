@@ -0,0 +1,111 @@
+"""
+Cấu hình engine DB cho production (SQLite nhiều gunicorn workers)
+
+DB_ENGINE_PROFILE=production (mặc định):
+- Engine ghi: journal_mode=WAL (reader không bị chặn bởi commit của writer),
+  synchronous=NORMAL, busy_timeout, cache_size, mmap_size; pool nhỏ vì SQLite
+  chỉ cho 1 writer tại 1 thời điểm.
+- Engine đọc (bind 'read'): cùng file với query_only=ON, pool riêng lớn hơn.
+  Dùng cho các GET của /api và agent (đọc nhiều, không ghi) - xem RoutingSession.
+  DATABASE_READ_URL trỏ tới replica nếu không dùng SQLite.
+DB_ENGINE_PROFILE=basic: giữ mặc định của SQLAlchemy (không pragma, không tách engine).
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from flask_sqlalchemy.session import Session
+
+READ_BIND = 'read'
+
+# Cờ trong session.info: True thì các SELECT đi qua engine đọc
+_READ_ONLY = 'read_only'
+
+
+def configure_engines(app):
+    """Ghi SQLALCHEMY_ENGINE_OPTIONS / SQLALCHEMY_BINDS theo profile, gọi trước db.init_app"""
+    config = app.config
+    if config.get('DB_ENGINE_PROFILE', 'production') != 'production':
+        return
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    read_url = config.get('DATABASE_READ_URL')
+    if _is_sqlite(url):
+        if url.database in (None, '', ':memory:'):
+            # In-memory: mỗi engine là 1 DB khác nhau, không tách được
+            return
+        read_url = read_url or url
+
+    options = config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    options.setdefault('pool_size', config['DB_POOL_SIZE'])
+    options.setdefault('max_overflow', config['DB_POOL_MAX_OVERFLOW'])
+    options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+    if read_url is not None:
+        binds = config.setdefault('SQLALCHEMY_BINDS', {})
+        binds.setdefault(READ_BIND, {
+            'url': read_url,
+            'pool_size': config['DB_READ_POOL_SIZE'],
+            'max_overflow': config['DB_POOL_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+        })
+
+
+def register_pragmas(app, engines):
+    """Gắn PRAGMA vào mỗi connection SQLite mới (gọi trong app context, trước khi kết nối)"""
+    config = app.config
+    if config.get('DB_ENGINE_PROFILE', 'production') != 'production':
+        return
+    common = [
+        f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        # Số âm: đơn vị KiB (mỗi connection)
+        f"PRAGMA cache_size = -{int(config['SQLITE_CACHE_SIZE_KB'])}",
+        f"PRAGMA mmap_size = {int(config['SQLITE_MMAP_SIZE'])}",
+        'PRAGMA temp_store = MEMORY',
+    ]
+    for key, engine in engines.items():
+        if not _is_sqlite(engine.url):
+            continue
+        if key == READ_BIND:
+            pragmas = common + ['PRAGMA query_only = ON']
+        else:
+            # WAL lưu trong file DB; NORMAL an toàn với WAL (chỉ có thể mất commit cuối khi mất điện)
+            pragmas = ['PRAGMA journal_mode = WAL', 'PRAGMA synchronous = NORMAL'] + common
+        event.listen(engine, 'connect', _pragma_listener(pragmas))
+
+
+def _pragma_listener(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+    return on_connect
+
+
+def _is_sqlite(url):
+    return make_url(url).get_backend_name() == 'sqlite'
+
+
+class RoutingSession(Session):
+    """
+    Session chọn engine đọc cho SELECT khi đã mark_read_only().
+    Ngay khi session ghi (flush hoặc insert/update/delete trực tiếp) thì mọi
+    query sau đó quay về engine ghi để đọc được dữ liệu vừa ghi.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get(_READ_ONLY) and (mapper is not None or clause is not None):
+            if self._flushing or getattr(clause, 'is_dml', False):
+                self.info[_READ_ONLY] = False
+            else:
+                engine = self._db.engines.get(READ_BIND)
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def mark_read_only(session=None):
+    """Cho các query SELECT tiếp theo của session (mặc định db.session) đi qua engine đọc"""
+    if session is None:
+        from app.models import db
+        session = db.session
+    session.info[_READ_ONLY] = True
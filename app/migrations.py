@@ -0,0 +1,113 @@
+"""
+Migrations schema đơn giản (db.create_all() chỉ tạo bảng mới, không sửa bảng cũ)
+
+Mỗi migration là 1 hàm nhận connection, chạy theo thứ tự version trong 1
+transaction riêng; version đã áp dụng được ghi trong bảng schema_version.
+Migrations phải chạy được trên DB vừa tạo bằng create_all (dùng IF NOT EXISTS).
+
+Chạy tự động khi create_app, hoặc thủ công:
+    flask --app run upgrade-db
+"""
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import text
+
+
+def _add_hot_query_indexes(connection):
+    """Index cho các query kiểm tra trùng phòng, lịch theo user, lịch rảnh/bận"""
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_booking_room_status_time '
+        'ON booking (room_id, status, end_time, start_time)'))
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_booking_user_status_start '
+        'ON booking (user_id, status, start_time)'))
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_booking_status_end '
+        'ON booking (status, end_time, start_time)'))
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_booking_status_start '
+        'ON booking (status, start_time)'))
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_user_availability_user_day '
+        'ON user_availability (user_id, day_of_week)'))
+
+
+def _backfill_user_profiles(connection):
+    """UserProfileStats/UserProfileSlot từ các bookings sẵn có"""
+    from sqlalchemy.orm import Session
+    from app.models import UserProfileStats
+    with Session(bind=connection) as session:
+        UserProfileStats.rebuild_all(session)
+
+
+def _seed_table_versions(connection):
+    from app.cache import seed_table_versions
+    seed_table_versions(connection)
+
+
+def _backfill_booking_counters(connection):
+    """BookingCounter/RoomHourUtilization từ các bookings sẵn có"""
+    from sqlalchemy.orm import Session
+    from app.models import BookingCounter
+    with Session(bind=connection) as session:
+        BookingCounter.rebuild_all(session)
+
+
+# (version, mô tả, hàm) - chỉ thêm vào cuối, không sửa migration đã phát hành
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, 'Composite indexes cho booking và user_availability', _add_hot_query_indexes),
+    (2, 'Tính UserProfileStats/UserProfileSlot từ bookings sẵn có', _backfill_user_profiles),
+    (3, 'Dòng TableVersion cho các bảng có ETag', _seed_table_versions),
+    (4, 'Tính BookingCounter/RoomHourUtilization từ bookings sẵn có', _backfill_booking_counters),
+]
+
+
+def current_version(connection) -> int:
+    _ensure_version_table(connection)
+    return connection.execute(text('SELECT COALESCE(MAX(version), 0) FROM schema_version')).scalar()
+
+
+def run_migrations(engine, metadata=None) -> List[int]:
+    """
+    Tạo các bảng còn thiếu của metadata (nếu có) rồi áp dụng các migrations chưa chạy.
+    Returns: các version vừa áp dụng
+    """
+    applied = []
+    with engine.begin() as connection:
+        _lock(connection)
+        if metadata is not None:
+            metadata.create_all(connection)
+        version = current_version(connection)
+    for number, description, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as connection:
+            _lock(connection)
+            # Worker khác có thể vừa chạy xong migration này
+            if current_version(connection) >= number:
+                continue
+            migrate(connection)
+            connection.execute(
+                text('INSERT INTO schema_version (version, description, applied_at) '
+                     'VALUES (:version, :description, :applied_at)'),
+                {'version': number, 'description': description, 'applied_at': datetime.utcnow()}
+            )
+        print(f"Đã áp dụng migration {number}: {description}")
+        applied.append(number)
+    return applied
+
+
+def _lock(connection):
+    """
+    Giữ write lock (SQLite) tới hết transaction: các worker khởi động cùng lúc
+    chờ nhau ở đây nên create_all và mỗi migration chỉ chạy đúng 1 lần
+    """
+    _ensure_version_table(connection)
+    connection.execute(text('UPDATE schema_version SET version = version WHERE 0 = 1'))
+
+
+def _ensure_version_table(connection):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        'version INTEGER PRIMARY KEY, description VARCHAR(200), applied_at DATETIME)'))
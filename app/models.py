@@ -1,9 +1,17 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from datetime import datetime
-import bcrypt
+from datetime import datetime, timedelta
+from app.database import RoutingSession
+from app.passwords import get_password_hasher
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+CLUB_COLORS = {
+    'Pro': '#FF6B6B',    # Red
+    'Multi': '#4ECDC4',  # Teal
+    'GCC': '#45B7D1'     # Blue
+}
+DEFAULT_CLUB_COLOR = '#95A5A6'
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -19,10 +27,14 @@ class User(UserMixin, db.Model):
     availability = db.relationship('UserAvailability', backref='user', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        self.password_hash = get_password_hasher().hash(password)
     
     def check_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        return get_password_hasher().verify(password, self.password_hash)
+    
+    def password_needs_rehash(self):
+        """Hash được tạo với cost khác BCRYPT_ROUNDS hiện tại"""
+        return get_password_hasher().needs_rehash(self.password_hash)
     
     def __repr__(self):
         return f'<User {self.username}>'
@@ -41,6 +53,18 @@ class Room(db.Model):
         return f'<Room {self.name}>'
 
 class Booking(db.Model):
+    __table_args__ = (
+        # Kiểm tra trùng phòng (booking.create, /api/check-availability): cận dưới
+        # end_time > start chỉ còn các bookings chưa kết thúc, start_time lọc trong index
+        db.Index('ix_booking_room_status_time', 'room_id', 'status', 'end_time', 'start_time'),
+        # Bookings của 1 user (my-bookings, my-events, thống kê)
+        db.Index('ix_booking_user_status_start', 'user_id', 'status', 'start_time'),
+        # Lọc theo khoảng thời gian (calendar, index phòng của agent)
+        db.Index('ix_booking_status_end', 'status', 'end_time', 'start_time'),
+        # Bookings bắt đầu trong 1 khoảng (ngày đầu cửa sổ lịch sử của agent)
+        db.Index('ix_booking_status_start', 'status', 'start_time'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
@@ -51,45 +75,395 @@ class Booking(db.Model):
     status = db.Column(db.String(20), default='confirmed')  # confirmed, cancelled, pending
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    @classmethod
+    def overlaps(cls, start=None, end=None):
+        """
+        Các điều kiện filter cho bookings giao với [start, end) (None = không giới hạn phía đó).
+        Đúng với booking dài bao nhiêu cũng được; index theo end_time biến end_time > start
+        thành cận dưới nên không phải đọc các bookings đã kết thúc
+        """
+        conditions = []
+        if start is not None:
+            conditions.append(cls.end_time > start)
+        if end is not None:
+            conditions.append(cls.start_time < end)
+        return conditions
+    
     def to_calendar_event(self):
         """Convert booking to FullCalendar format"""
-        return {
-            'id': self.id,
-            'title': f"{self.title} - {self.room.name}",
-            'start': self.start_time.isoformat(),
-            'end': self.end_time.isoformat(),
-            'backgroundColor': self._get_color_by_club(),
-            'borderColor': self._get_color_by_club(),
-            'extendedProps': {
-                'user': self.user.username,
-                'club': self.user.club,
-                'room': self.room.name,
-                'description': self.description,
-                'status': self.status
-            }
-        }
+        user = self.user
+        return _calendar_event(self.id, self.title, self.start_time, self.end_time,
+                               user.username, user.club, self.room.name,
+                               self.description, self.status)
     
     def _get_color_by_club(self):
-        colors = {
-            'Pro': '#FF6B6B',    # Red
-            'Multi': '#4ECDC4',  # Teal
-            'GCC': '#45B7D1'     # Blue
-        }
-        return colors.get(self.user.club, '#95A5A6')
+        return CLUB_COLORS.get(self.user.club, DEFAULT_CLUB_COLOR)
+    
+    @classmethod
+    def calendar_rows(cls, start=None, end=None, user_id=None, status='confirmed'):
+        """
+        Query chỉ lấy các cột cần cho calendar (join sẵn User, Room, không tạo
+        ORM objects), lọc các bookings giao với [start, end) nếu có
+        """
+        query = db.session.query(
+            cls.id, cls.title, cls.start_time, cls.end_time,
+            User.username, User.club, Room.name, cls.description, cls.status
+        ).join(User, cls.user_id == User.id).join(Room, cls.room_id == Room.id)
+        if status is not None:
+            query = query.filter(cls.status == status)
+        if user_id is not None:
+            query = query.filter(cls.user_id == user_id)
+        return query.filter(*cls.overlaps(start, end))
+    
+    @staticmethod
+    def calendar_event_from_row(row):
+        """to_calendar_event cho 1 row của calendar_rows"""
+        return _calendar_event(*row)
     
     def __repr__(self):
         return f'<Booking {self.title}>'
 
+def _calendar_event(booking_id, title, start_time, end_time, username, club,
+                    room_name, description, status):
+    color = CLUB_COLORS.get(club, DEFAULT_CLUB_COLOR)
+    return {
+        'id': booking_id,
+        'title': f"{title} - {room_name}",
+        'start': start_time.isoformat(),
+        'end': end_time.isoformat(),
+        'backgroundColor': color,
+        'borderColor': color,
+        'extendedProps': {
+            'user': username,
+            'club': club,
+            'room': room_name,
+            'description': description,
+            'status': status
+        }
+    }
+
 class UserAvailability(db.Model):
     """Track user's busy/available time slots"""
+    __table_args__ = (
+        db.Index('ix_user_availability_user_day', 'user_id', 'day_of_week'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     day_of_week = db.Column(db.Integer, nullable=False)  # 0=Monday, 6=Sunday
     start_hour = db.Column(db.Integer, nullable=False)   # 0-23
-    end_hour = db.Column(db.Integer, nullable=False)     # 0-23
+    end_hour = db.Column(db.Integer, nullable=False)     # 1-24 (không gồm giờ này)
     is_busy = db.Column(db.Boolean, default=False)       # True=busy, False=available
     recurring = db.Column(db.Boolean, default=True)     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    @classmethod
+    def save_for_user(cls, user_id, intervals):
+        """
+        Lưu lịch của 1 user theo kiểu diff: chỉ insert/update/delete các khoảng
+        thay đổi so với rows hiện có (bulk, trong transaction hiện tại, chưa commit).
+        
+        Args:
+            intervals: List (day_of_week, start_hour, end_hour, is_busy, recurring)
+                đã merge (xem merge_availability_intervals)
+        Returns:
+            (counts, final): counts = {'inserted', 'updated', 'deleted', 'unchanged'},
+            final = các khoảng sau khi lưu theo thứ tự id
+        """
+        from sqlalchemy import delete, insert, update
+        
+        current = db.session.query(
+            cls.id, cls.day_of_week, cls.start_hour, cls.end_hour, cls.is_busy, cls.recurring
+        ).filter(cls.user_id == user_id).order_by(cls.id).all()
+        
+        wanted = {}
+        for interval in intervals:
+            wanted[interval] = wanted.get(interval, 0) + 1
+        kept = {}
+        stale = []
+        for row_id, *values in current:
+            values = (values[0], values[1], values[2], bool(values[3]), bool(values[4]))
+            if wanted.get(values):
+                wanted[values] -= 1
+                kept[row_id] = values
+            else:
+                stale.append(row_id)
+        added = [interval for interval, count in wanted.items() for _ in range(count)]
+        
+        # Row cũ không còn dùng được tái sử dụng cho khoảng mới (UPDATE thay vì DELETE + INSERT)
+        updates = list(zip(stale, added))
+        deletes = stale[len(updates):]
+        inserts = added[len(updates):]
+        
+        fields = ('day_of_week', 'start_hour', 'end_hour', 'is_busy', 'recurring')
+        if updates:
+            db.session.execute(update(cls), [
+                {'id': row_id, **dict(zip(fields, values))} for row_id, values in updates
+            ])
+        if deletes:
+            db.session.execute(delete(cls).where(cls.id.in_(deletes)))
+        if inserts:
+            db.session.execute(insert(cls), [
+                {'user_id': user_id, **dict(zip(fields, values))} for values in inserts
+            ])
+        
+        final = {**kept, **dict(updates)}
+        counts = {'inserted': len(inserts), 'updated': len(updates),
+                  'deleted': len(deletes), 'unchanged': len(kept)}
+        return counts, [final[row_id] for row_id in sorted(final)] + inserts
+    
+    def __repr__(self):
+        return f'<UserAvailability {self.user.username} - Day {self.day_of_week}>'
+
+
+def merge_availability_intervals(entries):
+    """
+    Gộp các khoảng chồng lấn hoặc liền kề cùng (ngày, is_busy, recurring).
+    entries: dicts như request /api/availability gửi lên.
+    Returns: List (day_of_week, start_hour, end_hour, is_busy, recurring) đã sắp xếp.
+    Raise ValueError nếu entry không hợp lệ.
+    """
+    grouped = {}
+    for entry in entries:
+        try:
+            day = int(entry['day_of_week'])
+            start = int(entry['start_hour'])
+            end = int(entry['end_hour'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f'Invalid availability entry: {entry}')
+        if not 0 <= day <= 6 or not 0 <= start < end <= 24:
+            raise ValueError(f'Invalid availability range: {entry}')
+        key = (day, bool(entry.get('is_busy', False)), bool(entry.get('recurring', True)))
+        grouped.setdefault(key, []).append((start, end))
+    
+    merged = []
+    for (day, is_busy, recurring), ranges in grouped.items():
+        ranges.sort()
+        current_start, current_end = ranges[0]
+        for start, end in ranges[1:]:
+            if start <= current_end:
+                current_end = max(current_end, end)
+            else:
+                merged.append((day, current_start, current_end, is_busy, recurring))
+                current_start, current_end = start, end
+        merged.append((day, current_start, current_end, is_busy, recurring))
+    return sorted(merged)
+
+class UserProfileStats(db.Model):
+    """
+    Thống kê booking của từng user (materialized) cho AI agent.
+    Cập nhật dần khi tạo/hủy booking (UPDATE col = col + delta, không đọc rồi ghi),
+    rebuild toàn bộ bằng `flask rebuild-profiles`.
+    Bookings confirmed theo ngày/giờ (để agent lấy histogram trong cửa sổ
+    lịch sử) nằm ở UserProfileSlot.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_bookings = db.Column(db.Integer, nullable=False, default=0)      # Mọi trạng thái
+    confirmed_bookings = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @classmethod
+    def record_booking(cls, booking):
+        """Gọi khi tạo booking mới (trước commit, cùng transaction)"""
+        confirmed = (booking.status or 'confirmed') == 'confirmed'
+        _increment(cls, {'user_id': booking.user_id}, total_bookings=1, confirmed_bookings=int(confirmed))
+        if confirmed:
+            UserProfileSlot.record(booking.user_id, booking.start_time, 1)
+    
+    @classmethod
+    def record_cancellation(cls, booking):
+        """Gọi khi booking confirmed chuyển sang cancelled"""
+        _increment(cls, {'user_id': booking.user_id}, confirmed_bookings=-1)
+        UserProfileSlot.record(booking.user_id, booking.start_time, -1)
+    
+    @classmethod
+    def rebuild_all(cls, session=None):
+        """
+        Tính lại toàn bộ bảng (và UserProfileSlot) từ Booking. Returns: số users có thống kê
+        session: mặc định db.session (có commit); migration truyền session của nó (không commit)
+        """
+        from sqlalchemy import delete, insert
+        commit = session is None
+        session = session or db.session
+        totals = {}
+        slots = {}
+        rows = session.query(Booking.user_id, Booking.start_time, Booking.status)
+        for user_id, start_time, status in rows.yield_per(1000):
+            counts = totals.setdefault(user_id, [0, 0])
+            counts[0] += 1
+            if status == 'confirmed':
+                counts[1] += 1
+                key = UserProfileSlot.key(user_id, start_time)
+                slots[key] = slots.get(key, 0) + 1
+        
+        session.execute(delete(UserProfileSlot))
+        session.execute(delete(cls))
+        now = datetime.utcnow()
+        if totals:
+            session.execute(insert(cls), [
+                {'user_id': user_id, 'total_bookings': total, 'confirmed_bookings': confirmed, 'updated_at': now}
+                for user_id, (total, confirmed) in totals.items()])
+        if slots:
+            session.execute(insert(UserProfileSlot), [
+                {'user_id': user_id, 'day': day, 'hour': hour, 'count': count}
+                for (user_id, day, hour), count in slots.items()])
+        if commit:
+            session.commit()
+        return len(totals)
+    
+    def __repr__(self):
+        return f'<UserProfileStats {self.user_id}>'
+
+
+class UserProfileSlot(db.Model):
+    """
+    Số bookings confirmed của user theo (ngày 'YYYY-MM-DD', giờ bắt đầu), mỗi ô
+    1 row để tăng/giảm atomic. Agent cộng các ngày trong cửa sổ lịch sử thành
+    histogram giờ/ngày (xem MeetingSchedulerAgent.load_user_profiles).
+    """
+    __table_args__ = (
+        # Cửa sổ lịch sử của mọi users (LocalScorer)
+        db.Index('ix_user_profile_slot_day', 'day'),
+    )
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.String(10), primary_key=True)
+    hour = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    @staticmethod
+    def key(user_id, start_time):
+        return (user_id, start_time.strftime('%Y-%m-%d'), start_time.hour)
+    
+    @classmethod
+    def record(cls, user_id, start_time, delta):
+        user_id, day, hour = cls.key(user_id, start_time)
+        _increment(cls, {'user_id': user_id, 'day': day, 'hour': hour}, count=delta)
+    
+    def __repr__(self):
+        return f'<UserProfileSlot {self.user_id}/{self.day} {self.hour}h={self.count}>'
+
+
+def _increment(model, key, **deltas):
+    """UPDATE cột = cột + delta theo khóa chính (atomic), chưa có row thì INSERT"""
+    from sqlalchemy import insert, update
+    columns = model.__table__.c
+    result = db.session.execute(
+        update(model).where(*[columns[name] == value for name, value in key.items()])
+        .values({name: columns[name] + delta for name, delta in deltas.items()})
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.session.execute(insert(model).values(**key, **{name: max(delta, 0) for name, delta in deltas.items()}))
+
+
+class TableVersion(db.Model):
+    """
+    Bộ đếm thay đổi theo bảng (booking, room, user_availability, user).
+    Tăng trong cùng transaction với mỗi lần ghi (xem app.cache), dùng làm
+    ETag và khóa cache cho các API đọc.
+    """
+    table_name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<TableVersion {self.table_name}={self.version}>'
+
+
+class BookingCounter(db.Model):
+    """
+    Số bookings confirmed theo (club, phòng, bucket), cập nhật cùng transaction
+    khi tạo/hủy booking. bucket = 'all' (tổng) hoặc ngày 'YYYY-MM-DD'.
+    Rebuild: `flask rebuild-stats`.
+    """
+    club = db.Column(db.String(10), primary_key=True)
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), primary_key=True)
+    bucket = db.Column(db.String(10), primary_key=True)
+    bookings = db.Column(db.Integer, nullable=False, default=0)
+    minutes = db.Column(db.Integer, nullable=False, default=0)
+    
+    TOTAL = 'all'
+    
+    @classmethod
+    def record(cls, booking, club, delta=1):
+        """delta=1 khi tạo booking confirmed, -1 khi hủy"""
+        minutes = int((booking.end_time - booking.start_time).total_seconds() // 60)
+        for bucket in (cls.TOTAL, booking.start_time.strftime('%Y-%m-%d')):
+            _increment(cls, {'club': club, 'room_id': booking.room_id, 'bucket': bucket},
+                       bookings=delta, minutes=delta * minutes)
+        RoomHourUtilization.record(booking, delta)
+    
+    @classmethod
+    def rebuild_all(cls, session=None):
+        """
+        Tính lại counters và utilization từ bookings confirmed. Returns: số bookings
+        session: mặc định db.session (có commit); migration truyền session của nó (không commit)
+        """
+        from sqlalchemy import delete, insert
+        commit = session is None
+        session = session or db.session
+        session.execute(delete(cls))
+        session.execute(delete(RoomHourUtilization))
+        counters = {}
+        cells = {}
+        rows = session.query(Booking.room_id, Booking.start_time, Booking.end_time, User.club).join(
+            User, Booking.user_id == User.id
+        ).filter(Booking.status == 'confirmed')
+        count = 0
+        for room_id, start_time, end_time, club in rows.yield_per(1000):
+            count += 1
+            minutes = int((end_time - start_time).total_seconds() // 60)
+            for bucket in (cls.TOTAL, start_time.strftime('%Y-%m-%d')):
+                counter = counters.setdefault((club, room_id, bucket), [0, 0])
+                counter[0] += 1
+                counter[1] += minutes
+            for hour_of_week, cell_minutes in _hour_cells(start_time, end_time):
+                cell = cells.setdefault((room_id, hour_of_week), [0, 0])
+                cell[0] += 1
+                cell[1] += cell_minutes
+        
+        if counters:
+            session.execute(insert(cls), [
+                {'club': club, 'room_id': room_id, 'bucket': bucket, 'bookings': b, 'minutes': m}
+                for (club, room_id, bucket), (b, m) in counters.items()])
+        if cells:
+            session.execute(insert(RoomHourUtilization), [
+                {'room_id': room_id, 'hour_of_week': hour, 'bookings': b, 'minutes': m}
+                for (room_id, hour), (b, m) in cells.items()])
+        if commit:
+            session.commit()
+        return count
+    
+    def __repr__(self):
+        return f'<BookingCounter {self.club}/{self.room_id}/{self.bucket}={self.bookings}>'
+
+
+class RoomHourUtilization(db.Model):
+    """
+    Mức sử dụng phòng theo giờ trong tuần (hour_of_week = day_of_week * 24 + hour):
+    số bookings confirmed chạm vào ô và tổng số phút đã đặt trong ô
+    """
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), primary_key=True)
+    hour_of_week = db.Column(db.Integer, primary_key=True)  # 0-167
+    bookings = db.Column(db.Integer, nullable=False, default=0)
+    minutes = db.Column(db.Integer, nullable=False, default=0)
+    
+    @classmethod
+    def record(cls, booking, delta=1):
+        for hour_of_week, minutes in _hour_cells(booking.start_time, booking.end_time):
+            _increment(cls, {'room_id': booking.room_id, 'hour_of_week': hour_of_week},
+                       bookings=delta, minutes=delta * minutes)
+    
     def __repr__(self):
-        return f'<UserAvailability {self.user.username} - Day {self.day_of_week}>'
\ No newline at end of file
+        return f'<RoomHourUtilization {self.room_id}@{self.hour_of_week}>'
+
+
+def _hour_cells(start_time, end_time):
+    """Các ô (hour_of_week, số phút) mà [start_time, end_time) đi qua"""
+    current = start_time
+    while current < end_time:
+        next_hour = current.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        cell_end = min(next_hour, end_time)
+        yield current.weekday() * 24 + current.hour, int((cell_end - current).total_seconds() // 60)
+        current = cell_end
@@ -0,0 +1,68 @@
+"""
+Hash/kiểm tra mật khẩu bcrypt trên 1 executor giới hạn số thread
+
+bcrypt nhả GIL khi tính nên chạy song song được, nhưng mỗi lần tốn hàng
+trăm ms CPU. Gom vào pool PASSWORD_HASH_WORKERS thread để 1 đợt đăng nhập
+dồn dập không chiếm hết CPU của worker; quá PASSWORD_HASH_MAX_PENDING việc
+đang chờ thì từ chối ngay (PasswordHasherBusy) thay vì xếp hàng vô hạn.
+Cost (BCRYPT_ROUNDS) đổi thì hash cũ được tính lại khi user đăng nhập đúng.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import bcrypt
+
+
+class PasswordHasherBusy(Exception):
+    """Đã đủ số việc hash đang chờ/chạy"""
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int = 12, max_workers: int = 2, max_pending: int = 32):
+        self.rounds = rounds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+    def hash(self, password: str) -> str:
+        hashed = self._run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(self.rounds))
+        return hashed.decode('utf-8')
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        """Hash dạng $2b$<cost>$... có cost khác BCRYPT_ROUNDS hiện tại"""
+        parts = hashed.split('$')
+        return len(parts) > 2 and parts[2].isdigit() and int(parts[2]) != self.rounds
+
+    def _run(self, func, *args):
+        """Chạy func trên pool và chờ kết quả. Raise PasswordHasherBusy nếu pool đã đầy"""
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy('Too many pending password hashes')
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_password_hasher() -> PasswordHasher:
+    """PasswordHasher dùng chung của process (cấu hình qua Config)"""
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                from config import Config
+                _hasher = PasswordHasher(
+                    rounds=Config.BCRYPT_ROUNDS,
+                    max_workers=Config.PASSWORD_HASH_WORKERS,
+                    max_pending=Config.PASSWORD_HASH_MAX_PENDING
+                )
+    return _hasher
@@ -1,11 +1,105 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, current_app, jsonify, request, url_for
 from flask_login import login_required, current_user
-from app.ai.agent import create_agent
-from app.models import db
+from app.ai.agent import VALID_SLOT_MINUTES, get_agent
+from app.ai.jobs import JobQueueFull, get_job_manager
+from app.database import mark_read_only
 from datetime import datetime
+import json
 
 bp = Blueprint('agent', __name__)
 
+# Agent chỉ đọc DB (kể cả các POST suggest-*): query qua engine đọc (xem app.database)
+bp.before_request(mark_read_only)
+
+SSE_KEEPALIVE_SECONDS = 15
+
+VALID_OBJECTIVES = ['max_attendance', 'max_probability', 'fairness', 
+                    'mentor_priority', 'balanced']
+
+BATCH_MAX_MEETINGS = 20
+
+
+def _parse_suggest_params(data):
+    """
+    Đọc tham số suggest-slots từ request JSON
+    Returns: (params, error) - error là message nếu không hợp lệ
+    """
+    data = data or {}
+    params = {
+        'duration_minutes': data.get('duration_minutes', 60),
+        'constraints': data.get('constraints', {}),
+        'objective': data.get('objective', 'balanced'),
+        'days_ahead': data.get('days_ahead', 14),
+        'top_n': data.get('top_n', 3),
+        'slot_minutes': data.get('slot_minutes')
+    }
+    
+    # Validate objective
+    if params['objective'] not in VALID_OBJECTIVES:
+        return None, f'Invalid objective. Must be one of: {VALID_OBJECTIVES}'
+    
+    # Chế độ nhiều objectives: chấm điểm cùng 1 tập candidates cho từng objective
+    objectives = data.get('objectives')
+    if objectives is not None:
+        if (not isinstance(objectives, list) or not objectives or
+                any(objective not in VALID_OBJECTIVES for objective in objectives)):
+            return None, f'Invalid objectives. Must be a non-empty list of: {VALID_OBJECTIVES}'
+        params['objectives'] = objectives
+    if params['slot_minutes'] is not None and params['slot_minutes'] not in VALID_SLOT_MINUTES:
+        return None, f'Invalid slot_minutes. Must be one of: {list(VALID_SLOT_MINUTES)}'
+    return params, None
+
+
+def _serialize_slots(slots):
+    """Convert datetime objects to strings for JSON"""
+    serializable_slots = []
+    for slot in slots:
+        # Calculate duration from start and end time
+        slot_duration = int((slot['end_time'] - slot['start_time']).total_seconds() / 60)
+        
+        serializable_slot = {
+            'start_time': slot['start_time'].isoformat(),
+            'end_time': slot['end_time'].isoformat(),
+            'start_time_str': slot['start_time_str'],
+            'end_time_str': slot['end_time_str'],
+            'day_name': slot['day_name'],
+            'duration_minutes': slot_duration,
+            'score': slot.get('gpt_score_rounded', 0),
+            'available_count': slot['available_count'],
+            'mentor_count': slot['mentor_count'],
+            'objective': slot.get('objective', 'balanced'),
+            'ai_reasoning': slot.get('ai_reasoning', ''),
+            'room_id': slot.get('room_id'),
+            'room_name': slot.get('room_name'),
+            'user_details': slot['user_details']
+        }
+        serializable_slots.append(serializable_slot)
+    return serializable_slots
+
+
+def _suggest_slots_response(params, progress=None):
+    """Chạy agent và trả về body JSON giống response của /suggest-slots"""
+    agent = get_agent()
+    params = dict(params)
+    objectives = params.pop('objectives', None)
+    if objectives:
+        params.pop('objective')
+        results = agent.find_optimal_slots_multi(objectives, progress=progress, **params)
+        return {
+            'success': True,
+            'objectives': {objective: _serialize_slots(slots) for objective, slots in results.items()},
+            'message': f'Found optimal slots for {len(results)} objectives'
+        }
+    
+    slots = agent.find_optimal_slots(progress=progress, **params)
+    serializable_slots = _serialize_slots(slots)
+    return {
+        'success': True,
+        'slots': serializable_slots,
+        'message': f'Found {len(serializable_slots)} optimal slots'
+    }
+
+
 @bp.route('/suggest-slots', methods=['POST'])
 @login_required
 def suggest_slots():
@@ -18,11 +112,13 @@ def suggest_slots():
             "required_members": [1, 2, 3],
             "required_mentors": [4],
             "min_attendees": 5,
+            "expected_attendees": 12,
             "club_filter": "Pro"
         },
         "objective": "balanced",
         "days_ahead": 14,
-        "top_n": 3
+        "top_n": 3,
+        "slot_minutes": 30
     }
     
     Response:
@@ -31,62 +127,123 @@ def suggest_slots():
         "slots": [...],
         "message": "Found 3 optimal slots"
     }
+    
+    Nếu gửi "objectives": ["max_attendance", "fairness", ...] thì candidates
+    chỉ được quét 1 lần và response trả về top N cho từng objective:
+    {
+        "success": true,
+        "objectives": {"max_attendance": [...], "fairness": [...]},
+        "message": "..."
+    }
     """
     try:
-        data = request.get_json()
+        params, error = _parse_suggest_params(request.get_json())
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
         
-        # Parse parameters
-        duration_minutes = data.get('duration_minutes', 60)
-        constraints = data.get('constraints', {})
-        objective = data.get('objective', 'balanced')
-        days_ahead = data.get('days_ahead', 14)
-        top_n = data.get('top_n', 3)
+        return jsonify(_suggest_slots_response(params))
         
-        # Validate objective
-        valid_objectives = ['max_attendance', 'max_probability', 'fairness', 
-                           'mentor_priority', 'balanced']
-        if objective not in valid_objectives:
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+def _parse_batch_params(data):
+    """
+    Đọc tham số suggest-batch từ request JSON
+    Returns: (params, error) - error là message nếu không hợp lệ
+    """
+    data = data or {}
+    meetings = data.get('meetings')
+    if not isinstance(meetings, list) or not meetings:
+        return None, 'Missing meetings (non-empty list)'
+    if len(meetings) > BATCH_MAX_MEETINGS:
+        return None, f'Too many meetings (max {BATCH_MAX_MEETINGS})'
+    
+    parsed = []
+    for idx, meeting in enumerate(meetings):
+        if not isinstance(meeting, dict):
+            return None, f'Meeting {idx}: must be an object'
+        item = {
+            'title': meeting.get('title'),
+            'duration_minutes': meeting.get('duration_minutes', 60),
+            'constraints': meeting.get('constraints') or {},
+            'objective': meeting.get('objective', 'balanced')
+        }
+        if item['objective'] not in VALID_OBJECTIVES:
+            return None, f'Meeting {idx}: invalid objective. Must be one of: {VALID_OBJECTIVES}'
+        if not isinstance(item['duration_minutes'], int) or item['duration_minutes'] <= 0:
+            return None, f'Meeting {idx}: duration_minutes must be a positive integer'
+        parsed.append(item)
+    
+    params = {
+        'meetings': parsed,
+        'days_ahead': data.get('days_ahead', 7),
+        'slot_minutes': data.get('slot_minutes')
+    }
+    if params['slot_minutes'] is not None and params['slot_minutes'] not in VALID_SLOT_MINUTES:
+        return None, f'Invalid slot_minutes. Must be one of: {list(VALID_SLOT_MINUTES)}'
+    return params, None
+
+
+@bp.route('/suggest-batch', methods=['POST'])
+@login_required
+def suggest_batch():
+    """
+    Xếp lịch nhiều meetings cùng lúc: không trùng phòng, không trùng
+    thành viên/mentor bắt buộc và không trùng giờ giữa 2 meeting cùng club
+    Request JSON:
+    {
+        "meetings": [
+            {"title": "Pro sync", "duration_minutes": 60,
+             "constraints": {"club_filter": "Pro", "min_attendees": 5}},
+            {"title": "Mentor session", "duration_minutes": 90,
+             "constraints": {"required_mentors": [4]}, "objective": "mentor_priority"}
+        ],
+        "days_ahead": 7,
+        "slot_minutes": 30
+    }
+    
+    Response:
+    {
+        "success": true,
+        "meetings": [{"meeting_index": 0, "title": "...", "scheduled": true, ...slot}, ...],
+        "analysis": "...",
+        "message": "Scheduled 2/2 meetings"
+    }
+    """
+    try:
+        params, error = _parse_batch_params(request.get_json())
+        if error:
             return jsonify({
                 'success': False,
-                'error': f'Invalid objective. Must be one of: {valid_objectives}'
+                'error': error
             }), 400
         
-        # Create agent and find slots
-        agent = create_agent(db.session)
-        slots = agent.find_optimal_slots(
-            duration_minutes=duration_minutes,
-            constraints=constraints,
-            objective=objective,
-            days_ahead=days_ahead,
-            top_n=top_n
-        )
-        
-        # Convert datetime objects to strings for JSON
-        serializable_slots = []
-        for slot in slots:
-            # Calculate duration from start and end time
-            slot_duration = int((slot['end_time'] - slot['start_time']).total_seconds() / 60)
-            
-            serializable_slot = {
-                'start_time': slot['start_time'].isoformat(),
-                'end_time': slot['end_time'].isoformat(),
-                'start_time_str': slot['start_time_str'],
-                'end_time_str': slot['end_time_str'],
-                'day_name': slot['day_name'],
-                'duration_minutes': slot_duration,
-                'score': slot.get('gpt_score_rounded', 0),
-                'available_count': slot['available_count'],
-                'mentor_count': slot['mentor_count'],
-                'objective': slot.get('objective', 'balanced'),
-                'ai_reasoning': slot.get('ai_reasoning', ''),
-                'user_details': slot['user_details']
-            }
-            serializable_slots.append(serializable_slot)
+        plan = get_agent().plan_meetings(**params)
+        results = []
+        for item in plan['meetings']:
+            if item['scheduled']:
+                results.append({
+                    'meeting_index': item['meeting_index'],
+                    'title': item['title'],
+                    'scheduled': True,
+                    **_serialize_slots([item])[0]
+                })
+            else:
+                results.append(item)
+        scheduled = sum(1 for item in results if item['scheduled'])
         
         return jsonify({
             'success': True,
-            'slots': serializable_slots,
-            'message': f'Found {len(serializable_slots)} optimal slots'
+            'meetings': results,
+            'analysis': plan['analysis'],
+            'message': f'Scheduled {scheduled}/{len(results)} meetings'
         })
         
     except Exception as e:
@@ -96,17 +253,133 @@ def suggest_slots():
         }), 500
 
 
+@bp.route('/suggest-slots/jobs', methods=['POST'])
+@login_required
+def create_suggest_job():
+    """
+    Chạy suggest-slots nền, trả về job id ngay
+    Request JSON: giống /suggest-slots
+    
+    Response (202):
+    {
+        "success": true,
+        "job_id": "...",
+        "status_url": "/api/agent/jobs/<job_id>",
+        "events_url": "/api/agent/jobs/<job_id>/events"
+    }
+    """
+    params, error = _parse_suggest_params(request.get_json())
+    if error:
+        return jsonify({
+            'success': False,
+            'error': error
+        }), 400
+    
+    app = current_app._get_current_object()
+    
+    def work(job):
+        with app.app_context():
+            mark_read_only()
+            return _suggest_slots_response(params, progress=job.publish)
+    
+    try:
+        job = get_job_manager().submit(work, owner_id=current_user.id)
+    except JobQueueFull as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 503
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': url_for('agent.get_job', job_id=job.id),
+        'events_url': url_for('agent.job_events', job_id=job.id)
+    }), 202
+
+
+def _get_own_job(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None or job.owner_id != current_user.id:
+        return None
+    return job
+
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """
+    Poll trạng thái job. Khi status == "done", "result" có cùng format
+    với response của /suggest-slots
+    """
+    job = _get_own_job(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'job': job.to_dict(),
+        'result': job.result
+    })
+
+
+@bp.route('/jobs/<job_id>/events', methods=['GET'])
+@login_required
+def job_events(job_id):
+    """
+    Server-sent events: mỗi giai đoạn là 1 event "progress"
+    (loading_data, building_grid, scanning_candidates, ai_analysis),
+    cuối cùng là event "done" chứa kết quả. Hỗ trợ header Last-Event-ID.
+    """
+    job = _get_own_job(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found'
+        }), 404
+    
+    last_id = request.headers.get('Last-Event-ID', type=int) or 0
+    
+    def stream():
+        seen = last_id
+        while True:
+            events = job.wait_events(seen, timeout=SSE_KEEPALIVE_SECONDS)
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            for event in events:
+                seen = event['id']
+                if event['stage'] == 'done':
+                    payload = {**job.to_dict(), 'result': job.result}
+                    yield _sse_message(event['id'], 'done', payload)
+                    return
+                yield _sse_message(event['id'], 'progress', event)
+    
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+def _sse_message(event_id, event, data):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint for AI Agent"""
     try:
-        agent = create_agent(db.session)
+        agent = get_agent()
         user_count = len(agent.get_all_users())
         
         return jsonify({
             'status': 'healthy',
             'agent': 'MeetingSchedulerAgent',
             'total_users': user_count,
+            'llm_cache': agent.response_cache.stats(),
             'version': '1.0.0'
         })
     except Exception as e:
@@ -164,7 +437,7 @@ def get_busy_users():
             }), 400
         
         # Get busy/available users
-        agent = create_agent(db.session)
+        agent = get_agent()
         result = agent.get_busy_users_for_slot(slot_datetime, duration_minutes)
         
         return jsonify({
@@ -1,25 +1,72 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 from flask_login import login_required, current_user
-from app.models import Booking, Room, UserAvailability, User, db
+from app.models import (Booking, BookingCounter, Room, RoomHourUtilization, UserAvailability, db,
+                        merge_availability_intervals)
+from app.cache import cached_json, current_version
+from app.database import mark_read_only
+from app.signals import availability_changed
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
 
 bp = Blueprint('api', __name__)
 
+@bp.before_request
+def _route_reads():
+    # GET chỉ đọc: query qua engine đọc (xem app.database)
+    if request.method in ('GET', 'HEAD'):
+        mark_read_only()
+
+# Các bảng mà payload calendar/stats phụ thuộc (xem app.cache)
+CALENDAR_TABLES = ('booking', 'user', 'room')
+# Stats đọc bộ đếm (BookingCounter/RoomHourUtilization luôn ghi cùng nhau)
+STATS_TABLES = ('booking_counter', 'room')
+
+def _parse_iso_datetime(value):
+    """Parse ISO datetime (kể cả dạng 'Z' hoặc có offset) thành datetime naive"""
+    parsed = datetime.fromisoformat(value.replace('Z', ''))
+    if parsed.tzinfo is not None:
+        parsed = parsed.replace(tzinfo=None)
+    return parsed
+
+def _calendar_range():
+    """
+    Khoảng [start, end) FullCalendar gửi kèm (?start=...&end=...)
+    Returns: (start, end, error) - thiếu tham số thì là None (không lọc)
+    """
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        return (_parse_iso_datetime(start) if start else None,
+                _parse_iso_datetime(end) if end else None,
+                None)
+    except ValueError as e:
+        return None, None, f'Invalid datetime format: {str(e)}'
+
 @bp.route('/events')
 @login_required
 def get_events():
-    """Get all bookings for calendar display"""
-    bookings = Booking.query.filter_by(status='confirmed').all()
-    events = [booking.to_calendar_event() for booking in bookings]
-    return jsonify(events)
+    """Get bookings for calendar display (chỉ trong khoảng start/end đang hiển thị)"""
+    start, end, error = _calendar_range()
+    if error:
+        return jsonify({'error': error}), 400
+    
+    def build():
+        return [Booking.calendar_event_from_row(row) for row in Booking.calendar_rows(start, end)]
+    return cached_json(CALENDAR_TABLES, build, start, end)
 
 @bp.route('/my-events')
 @login_required
 def get_my_events():
     """Get current user's bookings for calendar display"""
-    bookings = Booking.query.filter_by(user_id=current_user.id, status='confirmed').all()
-    events = [booking.to_calendar_event() for booking in bookings]
-    return jsonify(events)
+    start, end, error = _calendar_range()
+    if error:
+        return jsonify({'error': error}), 400
+    user_id = current_user.id
+    
+    def build():
+        rows = Booking.calendar_rows(start, end, user_id=user_id)
+        return [Booking.calendar_event_from_row(row) for row in rows]
+    return cached_json(CALENDAR_TABLES, build, user_id, start, end)
 
 @bp.route('/rooms')
 @login_required
@@ -45,17 +92,8 @@ def check_availability():
         return jsonify({'error': 'Missing parameters'}), 400
     
     try:
-        start_str_clean = start_str.replace('Z', '')
-        end_str_clean = end_str.replace('Z', '')
-        
-        start_time = datetime.fromisoformat(start_str_clean)
-        end_time = datetime.fromisoformat(end_str_clean)
-        
-        if start_time.tzinfo is not None:
-            start_time = start_time.replace(tzinfo=None)
-        if end_time.tzinfo is not None:
-            end_time = end_time.replace(tzinfo=None)
-            
+        start_time = _parse_iso_datetime(start_str)
+        end_time = _parse_iso_datetime(end_str)
     except ValueError as e:
         return jsonify({'error': f'Invalid datetime format: {str(e)}'}), 400
     
@@ -63,10 +101,11 @@ def check_availability():
     if not room:
         return jsonify({'error': f'Room with ID {room_id} not found'}), 404
     
-    conflicts = Booking.query.filter(
+    conflicts = Booking.query.options(
+        joinedload(Booking.user), joinedload(Booking.room)
+    ).filter(
         Booking.room_id == room_id,
-        Booking.start_time < end_time,
-        Booking.end_time > start_time,
+        *Booking.overlaps(start_time, end_time),
         Booking.status == 'confirmed'
     ).all()
 
@@ -82,52 +121,97 @@ def check_availability():
 def user_availability():
     """Manage user availability/busy times"""
     if request.method == 'GET':
-        availability = UserAvailability.query.filter_by(user_id=current_user.id).all()
-        return jsonify([{
-            'id': av.id,
-            'day_of_week': av.day_of_week,
-            'start_hour': av.start_hour,
-            'end_hour': av.end_hour,
-            'is_busy': av.is_busy,
-            'recurring': av.recurring
-        } for av in availability])
+        user_id = current_user.id
+        
+        def build():
+            availability = UserAvailability.query.filter_by(user_id=user_id).all()
+            return [{
+                'id': av.id,
+                'day_of_week': av.day_of_week,
+                'start_hour': av.start_hour,
+                'end_hour': av.end_hour,
+                'is_busy': av.is_busy,
+                'recurring': av.recurring
+            } for av in availability]
+        return cached_json(('user_availability',), build, user_id)
     
     elif request.method == 'POST':
-        data = request.get_json()
-        
-        UserAvailability.query.filter_by(user_id=current_user.id).delete()
-
-        for entry in data.get('availability', []):
-            av = UserAvailability(
-                user_id=current_user.id,
-                day_of_week=entry['day_of_week'],
-                start_hour=entry['start_hour'],
-                end_hour=entry['end_hour'],
-                is_busy=entry.get('is_busy', False),
-                recurring=entry.get('recurring', True)
-            )
-            db.session.add(av)
+        # Body phải là object có list 'availability' (list rỗng = xóa hết lịch),
+        # không coi body lỗi/thiếu field là yêu cầu xóa toàn bộ
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('availability'), list):
+            return jsonify({'success': False,
+                            'error': "Body phải là JSON object có list 'availability'"}), 400
+        try:
+            intervals = merge_availability_intervals(data['availability'])
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
+        # Chỉ ghi phần thay đổi, bulk trong 1 transaction
+        counts, final = UserAvailability.save_for_user(current_user.id, intervals)
+        changed = counts['inserted'] or counts['updated'] or counts['deleted']
+        version = current_version('user_availability') if changed else None
         db.session.commit()
-        return jsonify({'success': True})
+        
+        if changed:
+            availability_changed.send(current_app._get_current_object(), user_id=current_user.id,
+                                      intervals=final, version=version)
+        return jsonify({'success': True, 'changes': counts})
 
 @bp.route('/stats')
 @login_required
 def get_stats():
-    from sqlalchemy import func
-    club_stats = db.session.query(
-        User.club,
-        func.count(Booking.id)
-    ).join(User, Booking.user_id == User.id).filter(
-        Booking.status == 'confirmed'
-    ).group_by(User.club).all()
+    return cached_json(STATS_TABLES, _build_stats)
+
+def _build_stats():
+    # Đọc tổng đã cộng sẵn (BookingCounter, bucket 'all') thay vì GROUP BY trên cả bảng Booking
+    totals = db.session.query(
+        BookingCounter.club, BookingCounter.room_id, BookingCounter.bookings
+    ).filter(BookingCounter.bucket == BookingCounter.TOTAL).all()
+    room_names = dict(db.session.query(Room.id, Room.name))
     
-    room_stats = db.session.query(
-        Room.name,
-        func.count(Booking.id)
-    ).join(Booking).filter(Booking.status == 'confirmed').group_by(Room.name).all()
+    club_bookings = {}
+    room_utilization = {}
+    for club, room_id, count in totals:
+        if count <= 0 or room_id not in room_names:
+            continue
+        club_bookings[club] = club_bookings.get(club, 0) + count
+        name = room_names[room_id]
+        room_utilization[name] = room_utilization.get(name, 0) + count
     
-    return jsonify({
-        'club_bookings': dict(club_stats),
-        'room_utilization': dict(room_stats)
-    })
\ No newline at end of file
+    return {
+        'club_bookings': club_bookings,
+        'room_utilization': room_utilization
+    }
+
+@bp.route('/stats/utilization')
+@login_required
+def get_utilization():
+    """
+    Mức sử dụng từng phòng theo giờ trong tuần: grid 7 hàng (Thứ 2 -> CN) x 24 giờ,
+    giá trị là số phút đã đặt (?metric=bookings để lấy số lượt đặt)
+    """
+    metric = request.args.get('metric', 'minutes')
+    if metric not in ('minutes', 'bookings'):
+        return jsonify({'error': 'metric phải là minutes hoặc bookings'}), 400
+    return cached_json(STATS_TABLES, lambda: _build_utilization(metric), metric)
+
+def _build_utilization(metric):
+    rooms = Room.query.order_by(Room.id).all()
+    grids = {room.id: [[0] * 24 for _ in range(7)] for room in rooms}
+    column = getattr(RoomHourUtilization, metric)
+    for room_id, hour_of_week, value in db.session.query(
+        RoomHourUtilization.room_id, RoomHourUtilization.hour_of_week, column
+    ):
+        if room_id in grids:
+            grids[room_id][hour_of_week // 24][hour_of_week % 24] = value
+    
+    return {
+        'metric': metric,
+        'rooms': [{
+            'room_id': room.id,
+            'room_name': room.name,
+            'capacity': room.capacity,
+            'grid': grids[room.id]
+        } for room in rooms]
+    }
\ No newline at end of file
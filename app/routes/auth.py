@@ -2,9 +2,13 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
 from app.models import User, db
 from app.forms import LoginForm, RegistrationForm
+from app.ai.directory import user_directory
+from app.passwords import PasswordHasherBusy
 
 bp = Blueprint('auth', __name__)
 
+BUSY_MESSAGE = 'Hệ thống đang bận, vui lòng thử lại sau giây lát.'
+
 @bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
@@ -13,7 +17,18 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
-        if user and user.check_password(form.password.data):
+        if user is not None:
+            # Trả connection DB về pool trong lúc chạy bcrypt (hàng trăm ms)
+            db.session.expunge(user)
+            db.session.rollback()
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+        except PasswordHasherBusy:
+            flash(BUSY_MESSAGE, 'warning')
+            return render_template('auth/login.html', title='Đăng nhập', form=form), 503
+        if valid:
+            db.session.add(user)
+            _rehash_if_needed(user, form.password.data)
             login_user(user)
             next_page = request.args.get('next')
             if not next_page or not next_page.startswith('/'):
@@ -24,6 +39,16 @@ def login():
     
     return render_template('auth/login.html', title='Đăng nhập', form=form)
 
+def _rehash_if_needed(user, password):
+    """BCRYPT_ROUNDS đã đổi: tính lại hash với cost mới (pool đang bận thì để lần đăng nhập sau)"""
+    if not user.password_needs_rehash():
+        return
+    try:
+        user.set_password(password)
+    except PasswordHasherBusy:
+        return
+    db.session.commit()
+
 @bp.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
@@ -36,9 +61,14 @@ def register():
             email=form.email.data,
             club=form.club.data
         )
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except PasswordHasherBusy:
+            flash(BUSY_MESSAGE, 'warning')
+            return render_template('auth/register.html', title='Đăng ký', form=form), 503
         db.session.add(user)
         db.session.commit()
+        user_directory.invalidate()
         flash('Đăng ký thành công! Bạn có thể đăng nhập ngay bây giờ.', 'success')
         return redirect(url_for('auth.login'))
     
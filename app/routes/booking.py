@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
-from app.models import Booking, Room, db
+from app.models import Booking, BookingCounter, Room, UserProfileStats, db
 from app.forms import BookingForm
 from datetime import datetime
 
@@ -16,8 +16,7 @@ def create():
         # Check for conflicts
         existing_booking = Booking.query.filter(
             Booking.room_id == form.room_id.data,
-            Booking.start_time < form.end_time.data,
-            Booking.end_time > form.start_time.data,
+            *Booking.overlaps(form.start_time.data, form.end_time.data),
             Booking.status == 'confirmed'
         ).first()
         
@@ -33,6 +32,8 @@ def create():
                 room_id=form.room_id.data
             )
             db.session.add(booking)
+            UserProfileStats.record_booking(booking)
+            BookingCounter.record(booking, current_user.club)
             db.session.commit()
             flash('Đặt phòng thành công!', 'success')
             return redirect(url_for('main.calendar'))
@@ -58,6 +59,9 @@ def cancel(booking_id):
         flash('Không thể hủy lịch đã qua hoặc đang diễn ra.', 'warning')
         return redirect(url_for('booking.my_bookings'))
     
+    if booking.status == 'confirmed':
+        UserProfileStats.record_cancellation(booking)
+        BookingCounter.record(booking, booking.user.club, delta=-1)
     booking.status = 'cancelled'
     db.session.commit()
     flash('Đã hủy lịch thành công.', 'success')
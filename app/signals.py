@@ -0,0 +1,11 @@
+"""
+Signals (blinker) để các cache trong process cập nhật dần thay vì xoá hết
+"""
+from blinker import Namespace
+
+_signals = Namespace()
+
+# Gửi sau khi lịch rảnh/bận của 1 user được commit.
+# kwargs: user_id, intervals (list (day_of_week, start_hour, end_hour, is_busy, recurring)
+# theo thứ tự id), version (bộ đếm user_availability sau transaction, xem app.cache)
+availability_changed = _signals.signal('availability-changed')
@@ -0,0 +1,114 @@
+"""
+Benchmark: độ trễ POST /auth/login theo số request đồng thời
+
+Mỗi mức concurrency chạy N threads, mỗi thread đăng nhập liên tục (test client
+riêng, DB tạm) trong --seconds giây. In ra logins/s, p50/p95/max và số lần
+bị từ chối 503 do pool bcrypt đầy (PASSWORD_HASH_MAX_PENDING).
+
+Chạy:
+    python benchmarks/login_latency.py
+    python benchmarks/login_latency.py --rounds 12 --workers 4 --levels 1 8 32 64
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USERNAME = 'bench'
+PASSWORD = 'bench-password'
+
+
+def _make_app(db_path, args):
+    # Config đọc env lúc import
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    os.environ['BCRYPT_ROUNDS'] = str(args.rounds)
+    os.environ['PASSWORD_HASH_WORKERS'] = str(args.workers)
+    os.environ['PASSWORD_HASH_MAX_PENDING'] = str(args.max_pending)
+    from app import create_app
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    return app
+
+
+def _login_loop(app, deadline, latencies, statuses, lock):
+    client = app.test_client()
+    local_latencies = []
+    local_statuses = {}
+    while time.time() < deadline:
+        began = time.perf_counter()
+        response = client.post('/auth/login', data={'username': USERNAME, 'password': PASSWORD})
+        local_latencies.append(time.perf_counter() - began)
+        local_statuses[response.status_code] = local_statuses.get(response.status_code, 0) + 1
+        client.get('/auth/logout')
+    with lock:
+        latencies.extend(local_latencies)
+        for status, count in local_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+
+
+def run_level(app, concurrency, seconds):
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+    threads = [threading.Thread(target=_login_loop, args=(app, deadline, latencies, statuses, lock))
+               for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    ok = statuses.get(302, 0)
+    return {
+        'concurrency': concurrency,
+        'logins_per_s': ok / seconds,
+        'p50_ms': _percentile(latencies, 50),
+        'p95_ms': _percentile(latencies, 95),
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+        'busy': statuses.get(503, 0),
+        'other': sum(count for status, count in statuses.items() if status not in (302, 503)),
+    }
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+    return sorted_values[index] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=12, help='BCRYPT_ROUNDS')
+    parser.add_argument('--workers', type=int, default=2, help='PASSWORD_HASH_WORKERS')
+    parser.add_argument('--max-pending', type=int, default=32, help='PASSWORD_HASH_MAX_PENDING')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = _make_app(os.path.join(tmp, 'bench.db'), args)
+        from app.models import User, db
+        with app.app_context():
+            user = User(username=USERNAME, email='bench@example.com', club='Pro')
+            user.set_password(PASSWORD)
+            db.session.add(user)
+            db.session.commit()
+
+        print(f'BCRYPT_ROUNDS={args.rounds}, {args.workers} workers, max pending {args.max_pending}, '
+              f'{args.seconds:g}s mỗi mức')
+        print(f"{'concurrency':>12}{'logins/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'503':>7}{'other':>7}")
+        for level in args.levels:
+            row = run_level(app, level, args.seconds)
+            print(f"{row['concurrency']:>12}{row['logins_per_s']:>10.1f}{row['p50_ms']:>10.1f}"
+                  f"{row['p95_ms']:>10.1f}{row['max_ms']:>10.1f}{row['busy']:>7}{row['other']:>7}")
+
+
+if __name__ == '__main__':
+    main()
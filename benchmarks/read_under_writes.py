@@ -0,0 +1,172 @@
+"""
+Benchmark: thông lượng đọc khi đang có ghi đồng thời (SQLite, nhiều process như gunicorn workers)
+
+Mỗi profile chạy trên 1 DB tạm riêng:
+- writers: lặp tạo booking giống booking.create (Booking + UserProfileStats + BookingCounter, commit)
+- readers: lặp query calendar 1 tháng (Booking.calendar_rows, không qua cache JSON),
+  trên db.session đã mark_read_only() như các GET của /api
+
+Chạy:
+    python benchmarks/read_under_writes.py
+    python benchmarks/read_under_writes.py --readers 8 --writers 2 --seconds 20 --profiles basic production
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SEED_USERS = 200
+SEED_BOOKINGS = 5000
+
+
+def _make_app(db_path, profile):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    os.environ['DB_ENGINE_PROFILE'] = profile
+    from app import create_app
+    return create_app()
+
+
+def _seed(db_path, profile):
+    app = _make_app(db_path, profile)
+    from app.models import Booking, BookingCounter, User, UserProfileStats, db
+    rnd = random.Random(1)
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    with app.app_context():
+        for i in range(SEED_USERS):
+            user = User(username=f'bench{i}', email=f'bench{i}@example.com',
+                        club=rnd.choice(['Pro', 'Multi', 'GCC']))
+            user.password_hash = 'x'
+            db.session.add(user)
+        db.session.flush()
+        for _ in range(SEED_BOOKINGS):
+            start = now + timedelta(days=rnd.randint(-60, 60), hours=rnd.randint(-12, 12))
+            db.session.add(Booking(title='seed', start_time=start, end_time=start + timedelta(hours=1),
+                                   user_id=rnd.randint(1, SEED_USERS), room_id=rnd.randint(1, 2)))
+        db.session.commit()
+        UserProfileStats.rebuild_all()
+        BookingCounter.rebuild_all()
+
+
+def _writer(db_path, profile, start, seconds, results):
+    app = _make_app(db_path, profile)
+    from app.models import Booking, BookingCounter, User, UserProfileStats, db
+    rnd = random.Random(os.getpid())
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    writes = errors = 0
+    start.wait()
+    deadline = time.time() + seconds
+    with app.app_context():
+        while time.time() < deadline:
+            try:
+                user = db.session.get(User, rnd.randint(1, SEED_USERS))
+                start = now + timedelta(days=rnd.randint(1, 60), hours=rnd.randint(0, 23))
+                booking = Booking(title='bench', start_time=start, end_time=start + timedelta(hours=1),
+                                  user_id=user.id, room_id=rnd.randint(1, 2))
+                db.session.add(booking)
+                UserProfileStats.record_booking(booking)
+                BookingCounter.record(booking, user.club)
+                db.session.commit()
+                writes += 1
+            except Exception:
+                db.session.rollback()
+                errors += 1
+    results.put(('write', writes, errors, []))
+
+
+def _reader(db_path, profile, start, seconds, results):
+    app = _make_app(db_path, profile)
+    from app.database import mark_read_only
+    from app.models import Booking, db
+    rnd = random.Random(os.getpid())
+    now = datetime.utcnow()
+    latencies = []
+    errors = 0
+    start.wait()
+    deadline = time.time() + seconds
+    with app.app_context():
+        while time.time() < deadline:
+            mark_read_only()
+            start = now + timedelta(days=rnd.randint(-30, 30))
+            began = time.perf_counter()
+            try:
+                Booking.calendar_rows(start, start + timedelta(days=30)).all()
+                latencies.append(time.perf_counter() - began)
+            except Exception:
+                errors += 1
+            finally:
+                db.session.remove()
+    results.put(('read', len(latencies), errors, latencies))
+
+
+def run_profile(profile, readers, writers, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        # Config đọc env lúc import nên mỗi bước chạy trong process riêng
+        ctx = multiprocessing.get_context('spawn')
+        seeder = ctx.Process(target=_seed, args=(db_path, profile))
+        seeder.start()
+        seeder.join()
+
+        results = ctx.Queue()
+        # Các process khởi động xong (import app) rồi mới cùng bắt đầu đếm giờ
+        start = ctx.Barrier(readers + writers)
+        args = (db_path, profile, start, seconds, results)
+        processes = [ctx.Process(target=_writer, args=args) for _ in range(writers)]
+        processes += [ctx.Process(target=_reader, args=args) for _ in range(readers)]
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    reads = sum(count for kind, count, _, _ in collected if kind == 'read')
+    writes = sum(count for kind, count, _, _ in collected if kind == 'write')
+    latencies = sorted(l for kind, _, _, ls in collected if kind == 'read' for l in ls)
+    return {
+        'profile': profile,
+        'reads_per_s': reads / seconds,
+        'writes_per_s': writes / seconds,
+        'read_errors': sum(errors for kind, _, errors, _ in collected if kind == 'read'),
+        'write_errors': sum(errors for kind, _, errors, _ in collected if kind == 'write'),
+        'p50_ms': _percentile(latencies, 50),
+        'p95_ms': _percentile(latencies, 95),
+        'p99_ms': _percentile(latencies, 99),
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+    }
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+    return sorted_values[index] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--profiles', nargs='+', default=['basic', 'production'],
+                        choices=['basic', 'production'])
+    args = parser.parse_args()
+
+    print(f'{args.readers} readers, {args.writers} writers, {args.seconds:g}s mỗi profile')
+    header = f"{'profile':<12}{'reads/s':>10}{'writes/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors r/w':>12}"
+    rows = [run_profile(profile, args.readers, args.writers, args.seconds) for profile in args.profiles]
+    print(header)
+    for row in rows:
+        print(f"{row['profile']:<12}{row['reads_per_s']:>10.1f}{row['writes_per_s']:>10.1f}"
+              f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}{row['max_ms']:>9.1f}"
+              f"{row['read_errors']:>6}/{row['write_errors']:<5}")
+
+
+if __name__ == '__main__':
+    main()
@@ -10,8 +10,54 @@ class Config:
         'sqlite:///' + os.path.join(basedir, 'clubsync.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # bcrypt (xem app/passwords.py): đổi BCRYPT_ROUNDS thì hash cũ được tính lại khi đăng nhập
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '32'))
+    
+    # Engine DB (xem app/database.py): production = WAL + pragmas + engine đọc riêng, basic = mặc định
+    DB_ENGINE_PROFILE = os.environ.get('DB_ENGINE_PROFILE', 'production').lower()
+    DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL')
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '3'))
+    DB_READ_POOL_SIZE = int(os.environ.get('DB_READ_POOL_SIZE', '10'))
+    DB_POOL_MAX_OVERFLOW = int(os.environ.get('DB_POOL_MAX_OVERFLOW', '5'))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', '16384'))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(128 * 1024 * 1024)))
+    
     # NVIDIA API Configuration
     AI_API_KEY = os.environ.get('AI_API_KEY')
     AI_MODEL = os.environ.get('AI_MODEL') or 'meta/llama3-8b-instruct'
     AI_TEMPERATURE = float(os.environ.get('AI_TEMPERATURE', '0.7'))
-    AI_MAX_TOKENS = int(os.environ.get('AI_MAX_TOKENS', '4000'))
\ No newline at end of file
+    AI_MAX_TOKENS = int(os.environ.get('AI_MAX_TOKENS', '4000'))
+    AI_STREAM = os.environ.get('AI_STREAM', 'true').lower() in ('1', 'true', 'yes')
+    
+    # HTTP connection pool tới inference endpoint
+    AI_HTTP_POOL_SIZE = int(os.environ.get('AI_HTTP_POOL_SIZE', '10'))
+    AI_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('AI_HTTP_KEEPALIVE_EXPIRY', '60'))
+    AI_HTTP_TIMEOUT = float(os.environ.get('AI_HTTP_TIMEOUT', '120'))
+    AI_HTTP_CONNECT_TIMEOUT = float(os.environ.get('AI_HTTP_CONNECT_TIMEOUT', '5'))
+    
+    # Cache kết quả chấm điểm của LLM (AI_CACHE_PATH: file SQLite dùng chung giữa workers)
+    AI_CACHE_TTL = float(os.environ.get('AI_CACHE_TTL', '3600'))
+    AI_CACHE_MAX_ENTRIES = int(os.environ.get('AI_CACHE_MAX_ENTRIES', '256'))
+    AI_CACHE_PATH = os.environ.get('AI_CACHE_PATH')
+    
+    # Chấm điểm slots: llm (luôn gọi AI), local (chỉ chấm tại chỗ),
+    # hybrid (chỉ gọi AI khi điểm local của top candidates sát nhau)
+    AI_SCORING_MODE = os.environ.get('AI_SCORING_MODE', 'llm').lower()
+    AI_AMBIGUITY_MARGIN = float(os.environ.get('AI_AMBIGUITY_MARGIN', '5'))
+    
+    # Job nền cho /api/agent/suggest-slots/jobs
+    AGENT_JOB_WORKERS = int(os.environ.get('AGENT_JOB_WORKERS', '2'))
+    AGENT_JOB_MAX_PENDING = int(os.environ.get('AGENT_JOB_MAX_PENDING', '20'))
+    AGENT_JOB_TTL = float(os.environ.get('AGENT_JOB_TTL', '600'))
+    
+    # ETag + cache JSON cho các API đọc (events, stats, availability)
+    # TABLE_VERSION_TTL: số giây tối đa 1 worker dùng bộ đếm thay đổi cũ trước khi đọc lại DB
+    TABLE_VERSION_TTL = float(os.environ.get('TABLE_VERSION_TTL', '1'))
+    API_CACHE_MAX_ENTRIES = int(os.environ.get('API_CACHE_MAX_ENTRIES', '512'))
+    
+    # Độ phân giải giờ bắt đầu slot được đề xuất (phút: 5, 10, 15, 20, 30, 60)
+    AGENT_SLOT_MINUTES = int(os.environ.get('AGENT_SLOT_MINUTES', '60'))